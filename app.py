@@ -1,16 +1,33 @@
 import os
+import csv
 import json
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
-from flask import Flask, request, redirect, url_for, session, jsonify, render_template
+from urllib.parse import urlencode
+import click
+from flask import Flask, Response, g, request, redirect, url_for, session, jsonify, render_template
 import requests
-from bs4 import BeautifulSoup
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import pandas as pd
-from google.cloud import storage
 from flask_session import Session
-from datetime import timedelta
+from datetime import date, datetime, timedelta
+from growth import (age_in_months, build_reference_engine, growth_metrics, out_of_range_indicators,
+                    reference_range, velocity_reference_tables)
+from charts import (ALL_CHART_SPECS, CHART_SEXES, CHART_SPECS, COMPOSITE_ROWS, chart_points, get_chart_backgrounds,
+                    get_composite_background, render_growth_chart, get_render_pool, warm_render_pool,
+                    submit_chart_renders, render_composite_chart, submit_composite_render)
+from reference import load_reference_data
+from svg_charts import get_svg_templates, render_svg_chart, render_svg_composite
+from jobs import JobQueue, QueueFull
+from tokens import TokenCache, SingleFlight
+import http_client
+import metrics
+from profiler import start_request_profile, finish_request_profile
+from report_parser import parse_report
+from session_store import SQLiteSessionInterface
+from result_cache import ResultCache, content_digest
+from history import MeasurementStore, child_key, trajectories
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,7 +37,8 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your_secret_key')
 
 # Configure Flask-Session for persistent storage
 app.config["SESSION_PERMANENT"] = True
-app.config["SESSION_TYPE"] = "filesystem"
+# sqlite (session_store.py), or any Flask-Session backend such as redis or filesystem
+app.config["SESSION_TYPE"] = os.getenv('SESSION_TYPE', 'sqlite')
 app.config["SESSION_FILE_DIR"] = "/tmp/flask_session"
 app.config["SESSION_USE_SIGNER"] = True
 app.config["SESSION_COOKIE_NAME"] = "bitrix_session"
@@ -29,7 +47,19 @@ app.config["SESSION_COOKIE_HTTPONLY"] = True
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=2)
 app.config["SESSION_REFRESH_EACH_REQUEST"] = True
 
-Session(app)
+if app.config["SESSION_TYPE"] == "sqlite":
+    app.session_interface = SQLiteSessionInterface(
+        app,
+        os.getenv('SESSION_DB_PATH', '/tmp/flask_session/sessions.db'),
+        use_signer=app.config["SESSION_USE_SIGNER"],
+        permanent=app.config["SESSION_PERMANENT"],
+        cache_ttl=float(os.getenv('SESSION_CACHE_TTL', 10)),
+        cache_size=int(os.getenv('SESSION_CACHE_SIZE', 1024)),
+        refresh_interval=float(os.getenv('SESSION_REFRESH_INTERVAL', 300)),
+        evict_interval=float(os.getenv('SESSION_EVICT_INTERVAL', 300)),
+    )
+else:
+    Session(app)
 
 # Configuration
 UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'static/charts')
@@ -38,19 +68,57 @@ GCS_BUCKET_NAME = os.getenv('GCS_BUCKET_NAME', 'child-growth-charts')
 CLIENT_ID = os.getenv("BITRIX_CLIENT_ID")
 CLIENT_SECRET = os.getenv("BITRIX_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("BITRIX_REDIRECT_URI")
+# Overridable so the app can run against local stand-ins (see benchmarks/bench_pipeline.py)
+BITRIX_OAUTH_URL = os.getenv("BITRIX_OAUTH_URL", "https://oauth.bitrix.info")
+BITRIX_PORTAL_URL = os.getenv("BITRIX_PORTAL_URL", "https://vitrah.bitrix24.com")
+BITRIX_WEBHOOK_URL = os.getenv("BITRIX_WEBHOOK_URL", f"{BITRIX_PORTAL_URL}/rest/1/15urrpzalz7xkysu")
+CHART_RENDER_WORKERS = int(os.getenv('CHART_RENDER_WORKERS', os.cpu_count() or 1))
+# matplotlib (PNG), svg (SVG templates) or svg-png (SVG templates rasterized with cairosvg)
+CHART_BACKEND = os.getenv('CHART_BACKEND', 'matplotlib')
+# separate (one image per chart) or composite (every chart as a panel of one image)
+CHART_LAYOUT = os.getenv('CHART_LAYOUT', 'separate')
+CHART_MANIFEST = os.getenv('CHART_MANIFEST', 'false').lower() in ('1', 'true', 'yes')
+GCS_UPLOAD_WORKERS = int(os.getenv('GCS_UPLOAD_WORKERS', 6))
+GCS_UPLOAD_TIMEOUT = float(os.getenv('GCS_UPLOAD_TIMEOUT', 30))
+GCS_UPLOAD_RETRIES = int(os.getenv('GCS_UPLOAD_RETRIES', 3))
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', 'false').lower() in ('1', 'true', 'yes')
+WEBHOOK_JOB_WORKERS = int(os.getenv('WEBHOOK_JOB_WORKERS', 4))
+WEBHOOK_JOB_MAX_PENDING = int(os.getenv('WEBHOOK_JOB_MAX_PENDING', 100))
+WEBHOOK_JOB_RESULT_TTL = int(os.getenv('WEBHOOK_JOB_RESULT_TTL', 3600))
+WEBHOOK_JOB_DB_PATH = os.getenv('WEBHOOK_JOB_DB_PATH', '/tmp/who_results/jobs.db')
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 8))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+RESULT_CACHE_PATH = os.getenv('RESULT_CACHE_PATH', '/tmp/who_results/results.db')
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 86400))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 10000))
+HISTORY_DB_PATH = os.getenv('HISTORY_DB_PATH', '/tmp/who_results/history.db')
+# name (normalized name and sex) or rpa_id
+HISTORY_KEY = os.getenv('HISTORY_KEY', 'name')
+# JSON object mapping metric keys to the RPA user fields (e.g. UF_RPA_1_1738600000) created for them
+BITRIX_METRIC_FIELDS = os.getenv('BITRIX_METRIC_FIELDS', '{}')
 
 # Ensure directories exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
-# Google Cloud Storage client
-storage_client = storage.Client()
+# Google Cloud Storage client, created on first upload
+storage_client = None
+storage_client_lock = threading.Lock()
+
+def get_storage_client():
+    global storage_client
+    with storage_client_lock:
+        if storage_client is None:
+            from google.cloud import storage
+            storage_client = storage.Client()
+        return storage_client
 
 def get_oauth_url():
-    return f"https://oauth.bitrix.info/oauth/authorize?client_id={CLIENT_ID}&response_type=code&redirect_uri={REDIRECT_URI}"
+    return f"{BITRIX_OAUTH_URL}/oauth/authorize?client_id={CLIENT_ID}&response_type=code&redirect_uri={REDIRECT_URI}"
 
 def get_token(code):
-    url = 'https://oauth.bitrix.info/oauth/token/'
+    url = f"{BITRIX_OAUTH_URL}/oauth/token/"
     data = {
         'grant_type': 'authorization_code',
         'client_id': CLIENT_ID,
@@ -58,60 +126,68 @@ def get_token(code):
         'code': code,
         'redirect_uri': REDIRECT_URI
     }
-    response = requests.post(url, data=data)
+    # Codes and refresh tokens are single-use, so a lost response must not be replayed
+    response = http_client.post(url, data=data, service="bitrix_oauth", idempotent=False)
     response.raise_for_status()
     return response.json()
 
 def refresh_bitrix_token(refresh_token):
-    url = "https://oauth.bitrix.info/oauth/token/"
+    url = f"{BITRIX_OAUTH_URL}/oauth/token/"
     data = {
         'grant_type': 'refresh_token',
         'client_id': CLIENT_ID,
         'client_secret': CLIENT_SECRET,
         'refresh_token': refresh_token
     }
-    response = requests.post(url, data=data)
+    # Codes and refresh tokens are single-use, so a lost response must not be replayed
+    response = http_client.post(url, data=data, service="bitrix_oauth", idempotent=False)
     if response.status_code == 200:
         return response.json()
     else:
         logging.error(f"Failed to refresh token: {response.text}")
         return None
 
-@app.route('/')
-def index():
-    logging.info(f"Session Data at /: {dict(session)}")  # Log full session data
-
-    access_token = session.get('access_token')
-    refresh_token = session.get('refresh_token')
-
-    if not access_token:
-        logging.warning("No access token found, redirecting to Bitrix login.")
-        return redirect(get_oauth_url())
-
-    # Test if token is valid
-    test_url = "https://vitrah.bitrix24.com/rest/user.current"
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(test_url, headers=headers)
-
-    if response.status_code == 401:  # Unauthorized, token expired
-        logging.warning("Access token expired. Attempting to refresh...")
-        new_token_data = refresh_bitrix_token(refresh_token)
-        if new_token_data:
-            session['access_token'] = new_token_data['access_token']
-            session['refresh_token'] = new_token_data['refresh_token']
-            session.modified = True
-            logging.info("Token refreshed successfully!")
-        else:
-            logging.error("Token refresh failed. Redirecting to login.")
-            return redirect(get_oauth_url())
+# Access tokens confirmed against Bitrix, and in-flight refreshes by refresh token
+token_cache = TokenCache(TOKEN_CACHE_TTL)
+token_refreshes = SingleFlight(result_ttl=60)
 
-    logging.info(f"User is authenticated. Access Token: {session['access_token']}")
-    return render_template('index.html')
+def refresh_access_token(refresh_token):
+    if not refresh_token:
+        return None
+    return token_refreshes.do(refresh_token, lambda: refresh_bitrix_token(refresh_token))
+
+def token_ttl(expires_at):
+    return None if expires_at is None else expires_at - time.time()
+
+def store_tokens(user_session, token_data):
+    """Put refreshed Bitrix tokens in the session and trust the new access token."""
+    user_session['access_token'] = token_data['access_token']
+    user_session['refresh_token'] = token_data['refresh_token']
+    if token_data.get('expires_in'):
+        user_session['expires_at'] = time.time() + int(token_data['expires_in'])
+    user_session.modified = True
+    token_cache.mark_valid(user_session['access_token'], token_ttl(user_session.get('expires_at')))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profile = start_request_profile()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or "unmatched"
+    metrics.REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    metrics.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    finish_request_profile(g.pop("profile", None), endpoint)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    body, content_type = metrics.render_latest()
+    return Response(body, content_type=content_type)
 
 @app.route('/')
 def index():
-    logging.info(f"Session Data at /: {session}")
-
     access_token = session.get('access_token')
     refresh_token = session.get('refresh_token')
 
@@ -119,169 +195,577 @@ def index():
         logging.warning("No access token found, redirecting to Bitrix login.")
         return redirect(get_oauth_url())
 
+    if token_cache.is_valid(access_token):
+        return render_template('index.html')
+
     # Test if token is valid
-    test_url = "https://vitrah.bitrix24.com/rest/user.current"
+    test_url = f"{BITRIX_PORTAL_URL}/rest/user.current"
     headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(test_url, headers=headers)
+    response = http_client.get(test_url, headers=headers, service="bitrix")
 
     if response.status_code == 401:  # Unauthorized, token expired
         logging.warning("Access token expired. Attempting to refresh...")
-        new_token_data = refresh_bitrix_token(refresh_token)
+        new_token_data = refresh_access_token(refresh_token)
         if new_token_data:
-            session['access_token'] = new_token_data['access_token']
-            session['refresh_token'] = new_token_data['refresh_token']
-            session.modified = True
+            store_tokens(session, new_token_data)
             logging.info("Token refreshed successfully!")
         else:
             logging.error("Token refresh failed. Redirecting to login.")
             return redirect(get_oauth_url())
+    elif response.ok:
+        token_cache.mark_valid(access_token, token_ttl(session.get('expires_at')))
+    else:
+        # Not trusted until Bitrix confirms it; the next page load checks again
+        logging.warning(f"Could not verify the access token (HTTP {response.status_code})")
 
-    logging.info(f"User is authenticated. Access Token: {session['access_token']}")
+    logging.info("User is authenticated.")
     return render_template('index.html')
 
-# Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
-
-# Google Cloud Storage client
-storage_client = storage.Client()
-
-def upload_to_gcs(file_path, destination_blob_name):
+@app.route('/oauth/callback')
+def oauth_callback():
+    code = request.args.get('code')
+    if not code:
+        return redirect(get_oauth_url())
     try:
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(destination_blob_name)
-
-        if not os.path.isfile(file_path):
-            logging.error(f"File not found: {file_path}")
-            return None
+        token_data = get_token(code)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to exchange authorization code: {e}")
+        return redirect(get_oauth_url())
 
-        blob.upload_from_filename(file_path)
-        return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{destination_blob_name}"
+    session['access_token'] = token_data['access_token']
+    session['refresh_token'] = token_data.get('refresh_token')
+    if token_data.get('expires_in'):
+        session['expires_at'] = time.time() + int(token_data['expires_in'])
+    return redirect(url_for('index'))
 
-    except Exception as e:
-        logging.error(f"Error uploading to GCS: {e}")
+def upload_to_gcs(data, destination_blob_name, content_type="image/png"):
+    if not data:
+        logging.error(f"Nothing to upload for {destination_blob_name}")
         return None
 
-def normalize_columns(dataframe):
-    column_mapping = {
-        "Year: Month": "Age (years)",
-        "Month": "Age (months)",
-        "3rd": "3rd Percentile",
-        "15th": "15th Percentile",
-        "50th": "50th Percentile",
-        "85th": "85th Percentile",
-        "97th": "97th Percentile",
-        "-3 SD": "-3SD Z-Scores",
-        "-2 SD": "-2SD Z-Scores",
-        "-1 SD": "-1SD Z-Scores",
-        "Median": "Median Z-Scores",
-        "1 SD": "1SD Z-Scores",
-        "2 SD": "2SD Z-Scores",
-        "3 SD": "3SD Z-Scores",
-        "3rdd": "3rd Z-Scores",
-        "15thh": "15th Z-Scores",
-        "Mediann": "Median Z Scores",
-        "85thh": "85th Z-Scores",
-        "97thh": "97th Z-Scores",
-    }
-    dataframe.rename(columns=column_mapping, inplace=True)
-    if "Age (years)" in dataframe.columns:
-        dataframe["Age (years)"] = dataframe["Age (years)"].apply(parse_age)
-    return dataframe
-
-def parse_age(year_month):
-    try:
-        years, months = map(int, year_month.split(":"))
-        return years + (months / 12)
-    except ValueError:
-        return None
+    bucket = get_storage_client().bucket(GCS_BUCKET_NAME)
+    blob = bucket.blob(destination_blob_name)
+    # Blob names are content-addressed, so retrying an upload is idempotent
+    with metrics.span("upload"):
+        for attempt in range(1, GCS_UPLOAD_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                blob.upload_from_string(data, content_type=content_type, timeout=GCS_UPLOAD_TIMEOUT)
+                metrics.observe_outbound("gcs", time.perf_counter() - start)
+                metrics.UPLOADED_BYTES.inc(len(data))
+                return f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{destination_blob_name}"
+            except Exception as e:
+                metrics.observe_outbound("gcs", time.perf_counter() - start, error=e)
+                logging.error(f"Error uploading to GCS (attempt {attempt}/{GCS_UPLOAD_RETRIES}): {e}")
+                if attempt < GCS_UPLOAD_RETRIES:
+                    metrics.RETRIES.labels("gcs").inc()
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+    metrics.record_failure("upload")
+    return None
+
+# Chart format -> (file extension, content type)
+CHART_FORMATS = {
+    "png": ("png", "image/png"),
+    "svg": ("svg", "image/svg+xml"),
+}
+
+def chart_format():
+    return "svg" if CHART_BACKEND == "svg" else "png"
+
+def chart_blob_name(name, key, image, extension="png"):
+    # Content-addressed so concurrent requests never overwrite each other's charts
+    digest = hashlib.sha256(image).hexdigest()[:16]
+    return f"{name}_{key}_{digest}.{extension}"
+
+upload_pool = ThreadPoolExecutor(max_workers=GCS_UPLOAD_WORKERS, thread_name_prefix="gcs-upload")
+
+_charts_warmed = False
+_charts_warm_lock = threading.Lock()
+
+def warm_charts():
+    """Build this worker's chart backgrounds (or SVG templates) before its first webhook.
+
+    Called from gunicorn's ``post_worker_init`` and the ASGI lifespan startup;
+    without it the first render in each worker pays for all of them.
+    """
+    global _charts_warmed
+    with _charts_warm_lock:
+        if _charts_warmed:
+            return
+        _charts_warmed = True
+        start = time.perf_counter()
+        try:
+            if CHART_BACKEND in ("svg", "svg-png"):
+                get_svg_templates(reference_data)
+            elif CHART_RENDER_WORKERS > 0:
+                pool = get_render_pool(reference_data, CHART_RENDER_WORKERS, composite=CHART_LAYOUT == "composite")
+                warm_render_pool(pool, CHART_RENDER_WORKERS)
+            elif CHART_LAYOUT == "composite":
+                for sex in CHART_SEXES:
+                    get_composite_background(reference_data, sex, COMPOSITE_ROWS)
+            else:
+                get_chart_backgrounds(reference_data)
+        except Exception as e:
+            logging.error(f"Error warming the charts; they will be built on first use: {e}")
+            return
+        logging.info(f"Chart backgrounds ready in {time.perf_counter() - start:.2f}s")
 
-def load_reference_data():
-    csv_files = {
-        "bmifa_boys_per": "csv_files/bmifa-boys-5-19years-per.csv",
-        "bmifa_boys_z": "csv_files/bmifa-boys-5-19years-z.csv",
-        "bmifa_girls_per": "csv_files/bmifa-girls-5-19years-per.csv",
-        "bmifa_girls_z": "csv_files/bmifa-girls-5-19years-z.csv",
-        "hfa_boys_per": "csv_files/hfa-boys-5-19years-per.csv",
-        "hfa_boys_z": "csv_files/sft-hfa-boys-perc-5-19years.csv",
-        "hfa_girls_per": "csv_files/hfa-girls-5-19years-per.csv",
-        "hfa_girls_z": "csv_files/sft-hfa-girls-perc-5-19years.csv",
-        "wfa_boys_per": "csv_files/wfa-boys-5-10years-per.csv",
-        "wfa_boys_z": "csv_files/wfa-boys-5-10years-z.csv",
-        "wfa_girls_per": "csv_files/wfa-girls-5-10years-per.csv",
-        "wfa_girls_z": "csv_files/wfa-girls-5-10years-z.csv",
+def _render_futures(gender_key, age, measurements, trajectories):
+    if CHART_RENDER_WORKERS > 0:
+        try:
+            pool = get_render_pool(reference_data, CHART_RENDER_WORKERS)
+            return submit_chart_renders(pool, gender_key, age, measurements, trajectories)
+        except Exception as e:
+            logging.error(f"Chart process pool unavailable, rendering in-process: {e}")
+    backgrounds = get_chart_backgrounds(reference_data)
+    return {
+        upload_pool.submit(render_growth_chart, backgrounds, key, gender_key, point_age, value, trajectory): key
+        for key, point_age, value, trajectory in chart_points(age, measurements, trajectories)
     }
-    data = {}
-    for key, file_path in csv_files.items():
+
+def rendered_charts(gender_key, age, measurements, trajectories):
+    """Yield (chart key, image bytes) as each chart finishes rendering."""
+    if CHART_BACKEND in ("svg", "svg-png"):
+        # Template substitution takes microseconds; no pool needed
+        templates = get_svg_templates(reference_data)
+        output = "svg" if CHART_BACKEND == "svg" else "png"
+        for key, point_age, value, trajectory in chart_points(age, measurements, trajectories):
+            yield key, render_svg_chart(templates, key, gender_key, point_age, value, output, trajectory)
+        return
+
+    render_futures = _render_futures(gender_key, age, measurements, trajectories)
+    for future in as_completed(render_futures):
+        key = render_futures[future]
+        try:
+            yield key, future.result()
+        except Exception as e:
+            logging.error(f"Error rendering {key}: {e}")
+            metrics.record_failure("render")
+            yield key, None
+
+def rendered_composite(gender_key, age, measurements, trajectories):
+    """Render the composite image; returns (image bytes, manifest)."""
+    if CHART_BACKEND in ("svg", "svg-png"):
+        output = "svg" if CHART_BACKEND == "svg" else "png"
+        return render_svg_composite(get_svg_templates(reference_data), gender_key,
+                                    list(chart_points(age, measurements, trajectories)), output)
+    if CHART_RENDER_WORKERS > 0:
         try:
-            df = pd.read_csv(file_path)
-            df = normalize_columns(df)
-            data[key] = df
+            pool = get_render_pool(reference_data, CHART_RENDER_WORKERS, composite=True)
+            return submit_composite_render(pool, gender_key, age, measurements, trajectories).result()
         except Exception as e:
-            logging.error(f"Error loading {file_path}: {e}")
-    return data
+            logging.error(f"Chart process pool unavailable, rendering in-process: {e}")
+    return render_composite_chart(reference_data, gender_key, list(chart_points(age, measurements, trajectories)))
+
+def composite_uploads(name, image, manifest):
+    """GCS objects for a composite render as (blob name, data, content type): the image, then its manifest."""
+    extension, content_type = CHART_FORMATS[chart_format()]
+    blob_name = chart_blob_name(name, "charts", image, extension)
+    uploads = [(blob_name, image, content_type)]
+    if CHART_MANIFEST:
+        manifest["image"] = blob_name
+        uploads.append((f"{blob_name.rsplit('.', 1)[0]}.json", json.dumps(manifest).encode(), "application/json"))
+    return uploads
+
+def composite_links(keys, uploads, links):
+    """Link every chart key to the uploaded composite; ``links`` line up with ``uploads``."""
+    if links[0]:
+        logging.info(f"Uploaded composite chart: {links[0]}")
+    else:
+        logging.error("Failed to upload the composite chart")
+    for (blob_name, _, _), link in zip(uploads[1:], links[1:]):
+        if not link:
+            logging.error(f"Failed to upload chart manifest {blob_name}")
+    return dict.fromkeys(keys, links[0])
+
+def render_and_upload_composite(name, gender_key, age, measurements, trajectories=None):
+    """Render every chart as a panel of one image and upload it once.
+
+    Every chart key links to the composite. With CHART_MANIFEST the panels'
+    crop regions are uploaded next to it as ``<image name>.json``.
+    """
+    keys = [key for key, *_ in chart_points(age, measurements, trajectories)]
+    image, manifest = rendered_composite(gender_key, age, measurements, trajectories)
+    if not image:
+        logging.error("Failed to render the composite chart")
+        metrics.record_failure("render")
+        return dict.fromkeys(keys)
+    uploads = composite_uploads(name, image, manifest)
+    futures = [upload_pool.submit(upload_to_gcs, data, blob_name, content_type)
+               for blob_name, data, content_type in uploads]
+    return composite_links(keys, uploads, [future.result() for future in futures])
+
+def render_and_upload_charts(name, gender_key, age, measurements, trajectories=None):
+    """Render every chart (plus velocity charts once there is a history) and upload them."""
+    if CHART_LAYOUT == "composite":
+        return render_and_upload_composite(name, gender_key, age, measurements, trajectories)
+    # Each chart's upload starts as soon as its render finishes
+    extension, content_type = CHART_FORMATS[chart_format()]
+    upload_futures = {}
+    rendered_keys = []
+    for key, image in rendered_charts(gender_key, age, measurements, trajectories):
+        rendered_keys.append(key)
+        if image:
+            blob_name = chart_blob_name(name, key, image, extension)
+            upload_futures[key] = upload_pool.submit(upload_to_gcs, image, blob_name, content_type)
+        else:
+            metrics.record_failure("render")
+    return chart_links(rendered_keys, {key: future.result() for key, future in upload_futures.items()})
+
+def chart_links(rendered_keys, uploaded):
+    """{chart key: GCS link} for the growth charts and any velocity charts rendered."""
+    gcs_links = {}
+    for key in ALL_CHART_SPECS:
+        if key not in CHART_SPECS and key not in rendered_keys:
+            continue
+        gcs_link = uploaded.get(key)
+        if gcs_link:
+            logging.info(f"Uploaded {key}: {gcs_link}")
+        else:
+            logging.error(f"Failed to upload {key}")
+        gcs_links[key] = gcs_link
+    return gcs_links
 
 reference_data = load_reference_data()
+reference_data.update(velocity_reference_tables(reference_data))
+result_cache = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES)
+measurement_history = MeasurementStore(HISTORY_DB_PATH)
+reference_engine = build_reference_engine(reference_data)
+
+# Metrics that can be sent to Bitrix, by their key in BITRIX_METRIC_FIELDS
+GROWTH_METRIC_KEYS = ("bmi_z", "bmi_percentile", "height_z", "height_percentile", "weight_z", "weight_percentile")
+# Each velocity also has a "<key>_chart" entry for its chart link
+VELOCITY_KEYS = ("height_velocity", "weight_velocity")
+
+def load_metric_fields(raw):
+    """Parse BITRIX_METRIC_FIELDS into ``{metric key: "fields[<code>]"}``.
+
+    The portal only keeps values for user fields that exist on the RPA type,
+    so metrics without a configured field are not sent.
+    """
+    try:
+        mapping = json.loads(raw or "{}")
+    except json.JSONDecodeError as e:
+        logging.error(f"BITRIX_METRIC_FIELDS is not valid JSON: {e}")
+        return {}
+    known = set(GROWTH_METRIC_KEYS) | set(VELOCITY_KEYS) | {f"{key}_chart" for key in VELOCITY_KEYS}
+    unknown = set(mapping) - known
+    if unknown:
+        logging.warning(f"Ignoring unknown BITRIX_METRIC_FIELDS keys: {', '.join(sorted(unknown))}")
+    return {key: f"fields[{code}]" for key, code in mapping.items() if key in known and code}
+
+METRIC_FIELDS = load_metric_fields(BITRIX_METRIC_FIELDS)
+
+def growth_metric_fields(growth):
+    return {METRIC_FIELDS[key]: growth.get(key) for key in GROWTH_METRIC_KEYS if key in METRIC_FIELDS}
+
+def velocity_fields(series, gcs_links):
+    fields = {}
+    for measure in VELOCITY_KEYS:
+        velocities = series.get(measure)
+        if measure in METRIC_FIELDS:
+            fields[METRIC_FIELDS[measure]] = round(velocities[-1][1], 2) if velocities else None
+        if f"{measure}_chart" in METRIC_FIELDS:
+            fields[METRIC_FIELDS[f"{measure}_chart"]] = gcs_links.get(measure)
+    return fields
 
 def extract_data_from_url(url):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        data_texts = soup.find_all("div", {"class": "data-text font-size-nom bold"})
-        box_texts = soup.find_all("div", {"class": "box"})
-        td_center_spans = soup.find_all("div", {"class": "td t-center", "style": "width:55%; text-align: right;"})
-
-        data = {
-            "name": soup.find("span", {"class": "name abs"}).text.strip() if soup.find("span", {"class": "name abs"}) else "Unknown",
-            "age": soup.find("span", {"class": "old abs"}).text.strip() if soup.find("span", {"class": "old abs"}) else "0",
-            "gender": soup.find("span", {"class": "sex abs"}).text.strip() if soup.find("span", {"class": "sex abs"}) else "Unknown",
-            "height": soup.find("span", {"class": "height abs"}).text.strip() if soup.find("span", {"class": "height abs"}) else "0 cm",
-            "weight": data_texts[0].text.strip() if len(data_texts) > 0 else "0",
-            "smm": data_texts[1].text.strip() if len(data_texts) > 1 else "0",
-            "bmi": data_texts[3].text.strip() if len(data_texts) > 3 else "0",
-            "pbf": data_texts[4].text.strip() if len(data_texts) > 4 else "0",
-            "score": box_texts[0].text.strip() if len(box_texts) > 0 else "0",
-            "ecf": soup.find_all("div", {"class": "bold"})[1].text.strip(),
-            "cf": soup.find_all("div", {"class": "bold"})[2].text.strip(),
-            "protein": soup.find_all("div", {"class": "bold"})[3].text.strip(),
-            "minerals": soup.find_all("div", {"class": "bold"})[4].text.strip(),
-            "fat": soup.find_all("div", {"class": "bold"})[5].text.strip(),
-            "body_water": soup.find_all("div", {"class": "bold"})[6].text.strip(),
-            "soft_lean_mass": soup.find_all("div", {"class": "bold"})[7].text.strip(),
-            "fat_free_mass": soup.find_all("div", {"class": "bold"})[8].text.strip(),
-            "body_fat_mass": data_texts[2].text.strip() if len(data_texts) > 2 else "0",
-            "basal_metabolic_rate": td_center_spans[0].find("span").text.strip() if len(td_center_spans) > 0 else "0",
-            "bone_mineral": td_center_spans[1].find("span").text.strip() if len(td_center_spans) > 1 else "0",
-            "waist_hip_ratio": td_center_spans[2].find("span").text.strip() if len(td_center_spans) > 2 else "0",
-            "visceral_fat_level": td_center_spans[3].find("span").text.strip() if len(td_center_spans) > 3 else "0",
-        }
-        return data
+        with metrics.span("scrape"):
+            response = http_client.get(url, service="report")
+            response.raise_for_status()
     except requests.exceptions.RequestException as e:
         logging.error(f"Error extracting data from URL: {e}")
         return None
+    with metrics.span("parse"):
+        return parse_report(response.content)
 
-def plot_growth_chart(data, age, metric, metric_label, title, output_path):
-    try:
-        plt.figure(figsize=(6, 8))
-        for col in ["3rd Percentile", "15th Percentile", "50th Percentile", "85th Percentile", "97th Percentile", 
-                    "-3SD Z-Scores", "-2SD Z-Scores", "-1SD Z-Scores", "Median Z-Scores", 
-                    "1SD Z-Scores", "2SD Z-Scores", "3SD Z-Scores", "3rd Z-Scores", 
-                    "15th Z-Scores", "Median Z Scores", "85th Z-Scores", "97th Z-Scores"]:
-            if col in data.columns:
-                plt.plot(data["Age (years)"], data[col], label=col)
-
-        plt.scatter([age], [metric], color="red", label="Child's Data", zorder=5)
-        plt.title(title)
-        plt.xlabel("Age (years)")
-        plt.ylabel(metric_label)
-        plt.legend()
-        plt.grid(True)
-        plt.savefig(output_path)
-        plt.close()
-    except Exception as e:
-        logging.error(f"Error in plot_growth_chart: {e}")
+class ExtractionError(Exception):
+    pass
+
+RPA_UPDATE_URL = f"{BITRIX_WEBHOOK_URL}/rpa.item.update.json"
+BITRIX_BATCH_URL = f"{BITRIX_WEBHOOK_URL}/batch.json"
+BITRIX_BATCH_SIZE = 50  # Bitrix accepts at most 50 commands per batch call
+
+def report_sex(extracted_data):
+    return 'boys' if extracted_data['gender'].lower() == 'male' else 'girls'
+
+# Date formats seen in report headers, tried in order
+REPORT_DATE_FORMATS = ("%Y.%m.%d", "%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y")
+
+def parse_report_date(text):
+    # Reports print the measurement time after the date
+    tokens = str(text or "").split()
+    if not tokens:
+        return None
+    for date_format in REPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(tokens[0], date_format).date()
+        except ValueError:
+            continue
+    return None
+
+def report_measured_on(extracted_data):
+    """The measurement date printed on the report, or today when it has none."""
+    return parse_report_date(extracted_data.get('measured_at')) or date.today()
+
+def report_age_months(extracted_data):
+    """The child's age in months at the measurement.
+
+    Exact (fractional) months when the report carries the birth date, measured
+    on the report date or today; otherwise the middle of the reported
+    completed year, so a reported 5 lands on the 5-year tables.
+    """
+    years = int(extracted_data['age'])
+    birth_date = parse_report_date(extracted_data.get('birth_date'))
+    if birth_date is None:
+        logging.info(f"No birth date in the report; approximating the age as {years} years 6 months")
+        return years * 12 + 6
+    measured_on = report_measured_on(extracted_data)
+    age_months = age_in_months(birth_date, measured_on)
+    if age_months < 0:
+        logging.warning(f"Birth date {birth_date} is after the measurement on {measured_on}; "
+                        f"approximating the age as {years} years 6 months")
+        return years * 12 + 6
+    if int(age_months // 12) != years:
+        logging.warning(f"Age from birth date ({age_months:.1f} months) disagrees with the reported {years} years")
+    return age_months
+
+def chart_series(series, sex):
+    """The history series limited to the ages each indicator's WHO table covers.
+
+    Earlier visits past a table's end (weight-for-age stops at 120 months) would
+    otherwise be drawn beyond the reference on an autoscaled chart. A velocity
+    series whose latest point is out of range is dropped, so no older velocity
+    is highlighted as the current one.
+    """
+    clipped = {}
+    for key, points in series.items():
+        indicator = key.split("_")[0]
+        months = reference_range(reference_engine, indicator, sex)
+        in_range = [(age, value) for age, value in points
+                    if months is not None and months[0] <= age * 12 <= months[1]]
+        if len(in_range) < len(points):
+            logging.info(f"Leaving {len(points) - len(in_range)} {key} points outside the WHO reference off the charts")
+        if key.endswith("_velocity") and points and (not in_range or in_range[-1] != points[-1]):
+            continue
+        clipped[key] = in_range
+    return clipped
+
+def score_visit(extracted_data, child, digest):
+    """Score the report and record it in the child's history; returns what the charts need."""
+    age_months = report_age_months(extracted_data)
+    age = age_months / 12
+    height = float(extracted_data['height'].replace("cm", ""))
+    weight = float(extracted_data['weight'])
+    bmi = float(extracted_data['bmi'])
+
+    gender_key = report_sex(extracted_data)
+    with metrics.span("zscores"):
+        growth = growth_metrics(reference_engine, gender_key, age_months, height, weight, bmi)
+    out_of_range = out_of_range_indicators(reference_engine, gender_key, age_months)
+    if out_of_range:
+        logging.warning(f"No WHO reference for {', '.join(out_of_range)} at {age_months:.1f} months")
+
+    measurements = {"bmi": bmi, "height": height, "weight": weight}
+    # Charts for indicators without a reference at this age show a note instead of the point
+    chart_measurements = {key: None if key in out_of_range else value for key, value in measurements.items()}
+    with metrics.span("history"):
+        measurement_history.add_visit(child, digest, extracted_data['name'], gender_key, age,
+                                      report_measured_on(extracted_data), measurements)
+        visits = measurement_history.visits(child)
+    series = trajectories(visits)
+    return {"sex": gender_key, "age": age, "age_months": age_months, "measurements": measurements,
+            "chart_measurements": chart_measurements, "out_of_range": out_of_range, "growth": growth,
+            "visits": len(visits), "series": series, "chart_series": chart_series(series, gender_key)}
+
+def compute_report(extracted_data, child, digest):
+    """Record the visit, then score and chart it; returns the cacheable report."""
+    visit = score_visit(extracted_data, child, digest)
+    with metrics.span("charts"):
+        gcs_links = render_and_upload_charts(extracted_data['name'], visit["sex"], visit["age"],
+                                             visit["chart_measurements"], visit["chart_series"])
+    return finish_report(extracted_data, child, visit, gcs_links)
+
+def finish_report(extracted_data, child, visit, gcs_links):
+    # The Bitrix age field holds completed years
+    age, growth = int(visit["age_months"] // 12), visit["growth"]
+    height, weight, bmi = (visit["measurements"][key] for key in ("height", "weight", "bmi"))
+    fields = {
+        "fields[UF_RPA_1_WEIGHT]": weight,
+        "fields[UF_RPA_1_HEIGHT]": height,
+        "fields[UF_RPA_1_1734279376]": bmi,
+        "fields[UF_RPA_1_1734278050]": age,
+        "fields[UF_RPA_1_1738508202]": extracted_data.get("gender"),
+        "fields[UF_RPA_1_1738508402]": gcs_links.get("bmi_chart_per"),
+        "fields[UF_RPA_1_1738508416]": gcs_links.get("bmi_chart_z"),
+        "fields[UF_RPA_1_1738508425]": gcs_links.get("height_chart_per"),
+        "fields[UF_RPA_1_1738508434]": gcs_links.get("height_chart_z"),
+        "fields[UF_RPA_1_1738508444]": gcs_links.get("weight_chart_per"),
+        "fields[UF_RPA_1_1738508458]": gcs_links.get("weight_chart_z"),
+        "fields[UF_RPA_1_1738508088]": extracted_data.get("score"),
+        "fields[UF_RPA_1_1738508230]": extracted_data.get("ecf"),
+        "fields[UF_RPA_1_1738508241]": extracted_data.get("cf"),
+        "fields[UF_RPA_1_1738508249]": extracted_data.get("protein"),
+        "fields[UF_RPA_1_1738508256]": extracted_data.get("minerals"),
+        "fields[UF_RPA_1_1738508263]": extracted_data.get("fat"),
+        "fields[UF_RPA_1_1738508271]": extracted_data.get("body_water"),
+        "fields[UF_RPA_1_1738508280]": extracted_data.get("soft_lean_mass"),
+        "fields[UF_RPA_1_1738508290]": extracted_data.get("fat_free_mass"),
+        "fields[UF_RPA_1_1738508302]": extracted_data.get("smm"),
+        "fields[UF_RPA_1_1738508319]": extracted_data.get("body_fat_mass"),
+        "fields[UF_RPA_1_1738508352]": extracted_data.get("basal_metabolic_rate"),
+        "fields[UF_RPA_1_1738508366]": extracted_data.get("bone_mineral"),
+        "fields[UF_RPA_1_1738508379]": extracted_data.get("waist_hip_ratio"),
+        "fields[UF_RPA_1_1738508390]": extracted_data.get("visceral_fat_level"),
+        "fields[UF_RPA_1_1738508329]": extracted_data.get("pbf")
+    }
+    fields.update(growth_metric_fields(growth))
+    fields.update(velocity_fields(visit["series"], gcs_links))
+    return {"name": extracted_data['name'], "sex": visit["sex"], "child": child, "visits": visit["visits"],
+            "age_months": round(visit["age_months"], 1), "out_of_range": visit["out_of_range"],
+            "fields": fields, "metrics": growth, "charts": gcs_links}
+
+def cached_report(modified_link, rpa_id):
+    """Return ``(digest, report)`` cached for the link, or ``(None, None)``."""
+    digest, report = result_cache.get_by_url(modified_link)
+    # Charts include the child's history, so a report cached for another child is a miss
+    if report is not None and report.get("child") != child_key(report["name"], report["sex"], rpa_id, HISTORY_KEY):
+        return None, None
+    return digest, report
+
+def report_identity(extracted_data, rpa_id):
+    """The child a report belongs to and the digest identifying its content."""
+    child = child_key(extracted_data['name'], report_sex(extracted_data), rpa_id, HISTORY_KEY)
+    return child, content_digest({"child": child, "report": extracted_data})
+
+def store_report(modified_link, digest, report):
+    # Charts that failed to upload are retried on the next call rather than cached
+    if all(report["charts"].values()):
+        result_cache.put(modified_link, digest, report)
+
+def report_update(rpa_id, report, cached):
+    """The RPA update and summary for a finished report."""
+    metrics.RESULT_CACHE_LOOKUPS.labels("hit" if cached else "miss").inc()
+    query_params = {"typeId": 1, "id": rpa_id}
+    query_params.update(report["fields"])
+    summary = {"rpa_id": rpa_id, "name": report["name"], "metrics": report["metrics"], "charts": report["charts"],
+               "visits": report["visits"], "age_months": report.get("age_months"),
+               "out_of_range": report.get("out_of_range", []), "cached": cached}
+    return query_params, summary
+
+def build_report(link, rpa_id):
+    """Scrape, score and chart one report; returns the RPA update and a summary."""
+    modified_link = modify_url(link)
+    digest, report = cached_report(modified_link, rpa_id)
+    cached = report is not None
+    if not cached:
+        extracted_data = extract_data_from_url(modified_link)
+        if not extracted_data:
+            raise ExtractionError("Failed to extract data from the provided link.")
+        child, digest = report_identity(extracted_data, rpa_id)
+        report = result_cache.get_by_digest(digest)
+        cached = report is not None
+        if not cached:
+            report = compute_report(extracted_data, child, digest)
+        store_report(modified_link, digest, report)
+    return report_update(rpa_id, report, cached)
+
+def send_rpa_update(query_params, access_token):
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+    with metrics.span("bitrix_update"):
+        response = http_client.post(RPA_UPDATE_URL, data=query_params, headers=headers, service="bitrix")
+        response.raise_for_status()
+    return response
+
+def run_pipeline(link, rpa_id, access_token):
+    query_params, summary = build_report(link, rpa_id)
+    summary["update_skipped"] = result_cache.update_unchanged(rpa_id, query_params)
+    if summary["update_skipped"]:
+        logging.info(f"RPA item {rpa_id} already has these values; skipping the Bitrix update")
+        metrics.BITRIX_UPDATES_SKIPPED.inc()
+    else:
+        send_rpa_update(query_params, access_token)
+        result_cache.mark_sent(rpa_id, query_params)
+    return summary
+
+def _batch_error_message(error):
+    if isinstance(error, dict):
+        return error.get("error_description") or error.get("error") or str(error)
+    return str(error)
+
+def send_rpa_batch(updates, access_token):
+    """Send {key: query_params} through Bitrix batch calls; returns {key: error or None}."""
+    headers = {
+        'Authorization': f'Bearer {access_token}'
+    }
+    errors = {}
+    keys = list(updates)
+    for start in range(0, len(keys), BITRIX_BATCH_SIZE):
+        chunk = keys[start:start + BITRIX_BATCH_SIZE]
+        data = {"halt": 0}
+        for key in chunk:
+            params = {name: value for name, value in updates[key].items() if value is not None}
+            data[f"cmd[{key}]"] = f"rpa.item.update?{urlencode(params)}"
+        try:
+            with metrics.span("bitrix_batch"):
+                response = http_client.post(BITRIX_BATCH_URL, data=data, headers=headers, service="bitrix")
+                response.raise_for_status()
+                result_errors = response.json().get("result", {}).get("result_error") or {}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.error(f"Bitrix batch call failed: {e}")
+            errors.update({key: str(e) for key in chunk})
+            continue
+        for key in chunk:
+            errors[key] = _batch_error_message(result_errors[key]) if key in result_errors else None
+    return errors
+
+def parse_batch_items(raw_items):
+    items = []
+    for raw in raw_items:
+        if isinstance(raw, dict):
+            link, rpa_id = raw.get("link"), raw.get("rpa_id")
+        elif isinstance(raw, (list, tuple)) and len(raw) == 2:
+            link, rpa_id = raw
+        else:
+            link, rpa_id = None, None
+        if not link or rpa_id in (None, ""):
+            raise ValueError(f"Each item needs a link and an RPA ID: {raw!r}")
+        items.append({"link": link, "rpa_id": str(rpa_id)})
+    return items
+
+def run_batch(items, access_token):
+    """Build every report concurrently, then push all updates in batch calls."""
+    results = [{"link": item["link"], "rpa_id": item["rpa_id"], "status": "pending"} for item in items]
+    updates = {}
+    with ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch") as pool:
+        futures = {pool.submit(build_report, item["link"], item["rpa_id"]): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                query_params, summary = future.result()
+            except Exception as e:
+                logging.error(f"Batch item {index} failed: {e}")
+                results[index].update(status="error", message=str(e))
+                continue
+            results[index]["summary"] = summary
+            summary["update_skipped"] = result_cache.update_unchanged(items[index]["rpa_id"], query_params)
+            if summary["update_skipped"]:
+                metrics.BITRIX_UPDATES_SKIPPED.inc()
+                results[index].update(status="success", message="Bitrix24 already has this data.")
+            else:
+                updates[f"item{index}"] = query_params
+
+    for key, error in send_rpa_batch(updates, access_token).items():
+        result = results[int(key[len("item"):])]
+        if error:
+            result.update(status="error", message=f"Failed to send data: {error}")
+        else:
+            result_cache.mark_sent(result["rpa_id"], updates[key])
+            result.update(status="success", message="Data sent successfully to Bitrix24!")
+    return results
 
 @app.route('/process', methods=['POST'])
 def process():
@@ -295,83 +779,10 @@ def process():
         return render_template('index.html', error="Please provide both a valid link and RPA ID.")
 
     try:
-        modified_link = modify_url(link)
-        extracted_data = extract_data_from_url(modified_link)
-        if not extracted_data:
-            return render_template('index.html', error="Failed to extract data from the provided link.")
-
-        age = int(extracted_data['age'])
-        height = float(extracted_data['height'].replace("cm", ""))
-        weight = float(extracted_data['weight'])
-        bmi = float(extracted_data['bmi'])
-
-        gender_key = 'boys' if extracted_data['gender'].lower() == 'male' else 'girls'
-
-        chart_paths = {
-            "bmi_chart_per": os.path.join(UPLOAD_FOLDER, "bmi_chart_per.png"),
-            "bmi_chart_z": os.path.join(UPLOAD_FOLDER, "bmi_chart_z.png"),
-            "height_chart_per": os.path.join(UPLOAD_FOLDER, "height_chart_per.png"),
-            "height_chart_z": os.path.join(UPLOAD_FOLDER, "height_chart_z.png"),
-            "weight_chart_per": os.path.join(UPLOAD_FOLDER, "weight_chart_per.png"),
-            "weight_chart_z": os.path.join(UPLOAD_FOLDER, "weight_chart_z.png")
-        }
-
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_per', pd.DataFrame()), age, bmi, "BMI", "BMI Chart", chart_paths["bmi_chart_per"])
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_z', pd.DataFrame()), age, bmi, "BMI Z-Score", "BMI Z-Score Chart", chart_paths["bmi_chart_z"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_per', pd.DataFrame()), age, height, "Height (cm)", "Height Chart", chart_paths["height_chart_per"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_z', pd.DataFrame()), age, height, "Height Z-Score", "Height Z-Score Chart", chart_paths["height_chart_z"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_per', pd.DataFrame()), age, weight, "Weight (kg)", "Weight Chart", chart_paths["weight_chart_per"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_z', pd.DataFrame()), age, weight, "Weight Z-Score", "Weight Z-Score Chart", chart_paths["weight_chart_z"])
-
-        gcs_links = {}
-        for key, path in chart_paths.items():
-            gcs_link = upload_to_gcs(path, f"{extracted_data['name']}_{key}.png")
-            if gcs_link:
-                logging.info(f"Uploaded {key}: {gcs_link}")
-            else:
-                logging.error(f"Failed to upload {key}")
-            gcs_links[key] = gcs_link
-
-        query_params = {
-            "typeId": 1,
-            "id": rpa_id,
-            "fields[UF_RPA_1_WEIGHT]": weight,
-            "fields[UF_RPA_1_HEIGHT]": height,
-            "fields[UF_RPA_1_1734279376]": bmi,
-            "fields[UF_RPA_1_1734278050]": age,
-            "fields[UF_RPA_1_1738508202]": extracted_data.get("gender"),
-            "fields[UF_RPA_1_1738508402]": gcs_links.get("bmi_chart_per"),
-            "fields[UF_RPA_1_1738508416]": gcs_links.get("bmi_chart_z"),
-            "fields[UF_RPA_1_1738508425]": gcs_links.get("height_chart_per"),
-            "fields[UF_RPA_1_1738508434]": gcs_links.get("height_chart_z"),
-            "fields[UF_RPA_1_1738508444]": gcs_links.get("weight_chart_per"),
-            "fields[UF_RPA_1_1738508458]": gcs_links.get("weight_chart_z"),
-            "fields[UF_RPA_1_1738508088]": extracted_data.get("score"),
-            "fields[UF_RPA_1_1738508230]": extracted_data.get("ecf"),
-            "fields[UF_RPA_1_1738508241]": extracted_data.get("cf"),
-            "fields[UF_RPA_1_1738508249]": extracted_data.get("protein"),
-            "fields[UF_RPA_1_1738508256]": extracted_data.get("minerals"),
-            "fields[UF_RPA_1_1738508263]": extracted_data.get("fat"),
-            "fields[UF_RPA_1_1738508271]": extracted_data.get("body_water"),
-            "fields[UF_RPA_1_1738508280]": extracted_data.get("soft_lean_mass"),
-            "fields[UF_RPA_1_1738508290]": extracted_data.get("fat_free_mass"),
-            "fields[UF_RPA_1_1738508302]": extracted_data.get("smm"),
-            "fields[UF_RPA_1_1738508319]": extracted_data.get("body_fat_mass"),
-            "fields[UF_RPA_1_1738508352]": extracted_data.get("basal_metabolic_rate"),
-            "fields[UF_RPA_1_1738508366]": extracted_data.get("bone_mineral"),
-            "fields[UF_RPA_1_1738508379]": extracted_data.get("waist_hip_ratio"),
-            "fields[UF_RPA_1_1738508390]": extracted_data.get("visceral_fat_level"),
-            "fields[UF_RPA_1_1738508329]": extracted_data.get("pbf")
-        }
-
-        target_url = "https://vitrah.bitrix24.com/rest/1/15urrpzalz7xkysu/rpa.item.update.json"
-        headers = {
-            'Authorization': f'Bearer {session["access_token"]}'
-        }
-        response = requests.post(target_url, data=query_params, headers=headers)
-        response.raise_for_status()
-
+        run_pipeline(link, rpa_id, session["access_token"])
         return render_template('index.html', success="Data sent successfully to Bitrix24!")
+    except ExtractionError as e:
+        return render_template('index.html', error=str(e))
     except requests.exceptions.RequestException as e:
         logging.error(f"Failed to send data: {e.response.text if e.response else str(e)}")
         return render_template('index.html', error=f"Failed to send data: {e.response.text if e.response else str(e)}")
@@ -386,6 +797,27 @@ def modify_url(url):
     modified_url = modified_url.replace('%26rpa', '&rpa')
     return modified_url
 
+webhook_jobs = JobQueue(WEBHOOK_JOB_DB_PATH, WEBHOOK_JOB_WORKERS, WEBHOOK_JOB_MAX_PENDING, WEBHOOK_JOB_RESULT_TTL)
+
+def enqueue_webhook(link, rpa_id, access_token):
+    return enqueue_job((rpa_id, link), run_pipeline, link, rpa_id, access_token)
+
+def enqueue_job(key, func, *args):
+    """Queue ``func(*args)`` on webhook_jobs and answer 202 with its status URL."""
+    try:
+        job, created = webhook_jobs.submit(key, func, *args)
+    except QueueFull as e:
+        logging.warning(f"Job queue full: {e}")
+        return jsonify({"status": "error", "message": "Too many pending jobs, retry later."}), 503, {"Retry-After": "30"}
+
+    status_url = url_for('job_status', job_id=job["id"])
+    return jsonify({
+        "status": "accepted",
+        "job_id": job["id"],
+        "duplicate": not created,
+        "status_url": status_url,
+    }), 202, {"Location": status_url}
+
 @app.route('/webhook', methods=['POST', 'GET'])
 def webhook():
     try:
@@ -402,84 +834,14 @@ def webhook():
         if not link or not rpa_id:
             return jsonify({"status": "error", "message": "Please provide both a valid link and RPA ID."}), 400
 
-        modified_link = modify_url(link)
+        if WEBHOOK_ASYNC:
+            return enqueue_webhook(link, rpa_id, session["access_token"])
 
-        extracted_data = extract_data_from_url(modified_link)
-        if not extracted_data:
-            return jsonify({"status": "error", "message": "Failed to extract data from the provided link."}), 400
-
-        age = int(extracted_data['age'])
-        height = float(extracted_data['height'].replace("cm", ""))
-        weight = float(extracted_data['weight'])
-        bmi = float(extracted_data['bmi'])
-
-        gender_key = 'boys' if extracted_data['gender'].lower() == 'male' else 'girls'
-
-        chart_paths = {
-            "bmi_chart_per": os.path.join(UPLOAD_FOLDER, "bmi_chart_per.png"),
-            "bmi_chart_z": os.path.join(UPLOAD_FOLDER, "bmi_chart_z.png"),
-            "height_chart_per": os.path.join(UPLOAD_FOLDER, "height_chart_per.png"),
-            "height_chart_z": os.path.join(UPLOAD_FOLDER, "height_chart_z.png"),
-            "weight_chart_per": os.path.join(UPLOAD_FOLDER, "weight_chart_per.png"),
-            "weight_chart_z": os.path.join(UPLOAD_FOLDER, "weight_chart_z.png")
-        }
-
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_per', pd.DataFrame()), age, bmi, "BMI", "BMI Chart", chart_paths["bmi_chart_per"])
-        plot_growth_chart(reference_data.get(f'bmifa_{gender_key}_z', pd.DataFrame()), age, bmi, "BMI Z-Score", "BMI Z-Score Chart", chart_paths["bmi_chart_z"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_per', pd.DataFrame()), age, height, "Height (cm)", "Height Chart", chart_paths["height_chart_per"])
-        plot_growth_chart(reference_data.get(f'hfa_{gender_key}_z', pd.DataFrame()), age, height, "Height Z-Score", "Height Z-Score Chart", chart_paths["height_chart_z"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_per', pd.DataFrame()), age, weight, "Weight (kg)", "Weight Chart", chart_paths["weight_chart_per"])
-        plot_growth_chart(reference_data.get(f'wfa_{gender_key}_z', pd.DataFrame()), age, weight, "Weight Z-Score", "Weight Z-Score Chart", chart_paths["weight_chart_z"])
-
-        gcs_links = {}
-        for key, path in chart_paths.items():
-            gcs_link = upload_to_gcs(path, f"{extracted_data['name']}_{key}.png")
-            if gcs_link:
-                logging.info(f"Uploaded {key}: {gcs_link}")
-            else:
-                logging.error(f"Failed to upload {key}")
-            gcs_links[key] = gcs_link
-
-        query_params = {
-            "typeId": 1,
-            "id": rpa_id,
-            "fields[UF_RPA_1_WEIGHT]": weight,
-            "fields[UF_RPA_1_HEIGHT]": height,
-            "fields[UF_RPA_1_1734279376]": bmi,
-            "fields[UF_RPA_1_1734278050]": age,
-            "fields[UF_RPA_1_1738508202]": extracted_data.get("gender"),
-            "fields[UF_RPA_1_1738508402]": gcs_links.get("bmi_chart_per"),
-            "fields[UF_RPA_1_1738508416]": gcs_links.get("bmi_chart_z"),
-            "fields[UF_RPA_1_1738508425]": gcs_links.get("height_chart_per"),
-            "fields[UF_RPA_1_1738508434]": gcs_links.get("height_chart_z"),
-            "fields[UF_RPA_1_1738508444]": gcs_links.get("weight_chart_per"),
-            "fields[UF_RPA_1_1738508458]": gcs_links.get("weight_chart_z"),
-            "fields[UF_RPA_1_1738508088]": extracted_data.get("score"),
-            "fields[UF_RPA_1_1738508230]": extracted_data.get("ecf"),
-            "fields[UF_RPA_1_1738508241]": extracted_data.get("cf"),
-            "fields[UF_RPA_1_1738508249]": extracted_data.get("protein"),
-            "fields[UF_RPA_1_1738508256]": extracted_data.get("minerals"),
-            "fields[UF_RPA_1_1738508263]": extracted_data.get("fat"),
-            "fields[UF_RPA_1_1738508271]": extracted_data.get("body_water"),
-            "fields[UF_RPA_1_1738508280]": extracted_data.get("soft_lean_mass"),
-            "fields[UF_RPA_1_1738508290]": extracted_data.get("fat_free_mass"),
-            "fields[UF_RPA_1_1738508302]": extracted_data.get("smm"),
-            "fields[UF_RPA_1_1738508319]": extracted_data.get("body_fat_mass"),
-            "fields[UF_RPA_1_1738508352]": extracted_data.get("basal_metabolic_rate"),
-            "fields[UF_RPA_1_1738508366]": extracted_data.get("bone_mineral"),
-            "fields[UF_RPA_1_1738508379]": extracted_data.get("waist_hip_ratio"),
-            "fields[UF_RPA_1_1738508390]": extracted_data.get("visceral_fat_level"),
-            "fields[UF_RPA_1_1738508329]": extracted_data.get("pbf")
-        }
-
-        target_url = "https://vitrah.bitrix24.com/rest/1/15urrpzalz7xkysu/rpa.item.update.json"
-        headers = {
-            'Authorization': f'Bearer {session["access_token"]}'
-        }
-        response = requests.post(target_url, data=query_params, headers=headers)
-        response.raise_for_status()
+        run_pipeline(link, rpa_id, session["access_token"])
 
         return jsonify({"status": "success", "message": "Data sent successfully to Bitrix24!"}), 200
+    except ExtractionError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except requests.exceptions.RequestException as e:
         logging.error(f"Failed to send data: {e.response.text if e.response else str(e)}")
         return jsonify({"status": "error", "message": f"Failed to send data: {e.response.text if e.response else str(e)}"}), 500
@@ -487,5 +849,62 @@ def webhook():
         logging.error(f"An unexpected error occurred: {e}")
         return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
 
+@app.route('/batch', methods=['POST'])
+def batch():
+    if 'access_token' not in session:
+        return redirect(get_oauth_url())
+
+    payload = request.get_json(silent=True)
+    raw_items = payload.get("items") if isinstance(payload, dict) else payload
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify({"status": "error", "message": "Provide a JSON list of {link, rpa_id} items."}), 400
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        return jsonify({"status": "error", "message": f"At most {BATCH_MAX_ITEMS} items per batch."}), 413
+
+    try:
+        items = parse_batch_items(raw_items)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # A full batch takes minutes, far past a sync worker's timeout, so it runs as a job
+    return enqueue_job(("batch", content_digest(items)), run_batch_job, items, session["access_token"])
+
+def run_batch_job(items, access_token):
+    results = run_batch(items, access_token)
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    return {
+        "status": "success" if succeeded == len(results) else "partial",
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+    }
+
+def read_batch_file(batch_file):
+    if batch_file.name.endswith(".csv"):
+        return list(csv.DictReader(batch_file))
+    content = batch_file.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+@app.cli.command("batch")
+@click.argument("batch_file", type=click.File("r"))
+@click.option("--access-token", envvar="BITRIX_ACCESS_TOKEN", required=True,
+              help="Bitrix access token (defaults to $BITRIX_ACCESS_TOKEN).")
+def batch_command(batch_file, access_token):
+    """Process a CSV/JSON/JSONL file of link,rpa_id pairs as one batch."""
+    items = parse_batch_items(read_batch_file(batch_file))
+    results = run_batch(items, access_token)
+    click.echo(json.dumps(results, indent=2))
+    failed = sum(1 for result in results if result["status"] != "success")
+    click.echo(f"{len(results) - failed} succeeded, {failed} failed", err=True)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = webhook_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job."}), 404
+    return jsonify(job), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
@@ -0,0 +1,145 @@
+"""ASGI entry point: ``/webhook`` on the asyncio pipeline, every other route on Flask.
+
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker --workers 2
+
+Webhooks run as coroutines on the worker's event loop (``async_pipeline.py``),
+so one worker holds as many in flight as its upstreams allow. The remaining
+routes are ordinary Flask views, served through ``a2wsgi`` on
+``ASGI_WSGI_THREADS`` threads.
+With ``WEBHOOK_ASYNC`` set, ``/webhook`` keeps its job-queue behaviour and is
+served by Flask too.
+"""
+import asyncio
+import contextvars
+import io
+import logging
+import os
+import time
+import httpx
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import g, jsonify, redirect, request, session
+from flask.ctx import RequestContext
+import app as pipeline
+from async_pipeline import AsyncPipeline
+from charts import shutdown_render_pool
+
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 8))
+
+flask_app = pipeline.app
+flask_view = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+_pipeline = None
+
+def get_pipeline():
+    """The event loop's pipeline, created by lifespan startup or on first use."""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = AsyncPipeline()
+    return _pipeline
+
+async def _read_body(receive):
+    """The request body, or None if the client disconnected first."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+def _merge_cookies(scope):
+    """Join repeated ``Cookie`` headers with "; " (RFC 9113 8.2.3).
+
+    WSGI has one value per header and adapters join repeats with ",", which
+    would run separate cookies together.
+    """
+    cookies = [value for name, value in scope["headers"] if name.lower() == b"cookie"]
+    if len(cookies) < 2:
+        return scope
+    headers = [(name, value) for name, value in scope["headers"] if name.lower() != b"cookie"]
+    return {**scope, "headers": headers + [(b"cookie", b"; ".join(cookies))]}
+
+async def _send_response(send, status, headers, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.encode("latin1"), value.encode("latin1")) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+def _error_text(error):
+    response = getattr(error, "response", None) if isinstance(error, httpx.HTTPStatusError) else None
+    return response.text if response is not None else str(error)
+
+async def _webhook_response():
+    # Mirrors app.webhook with the pipeline awaited on the event loop
+    try:
+        if 'access_token' not in session:
+            return redirect(pipeline.get_oauth_url())
+
+        source = request.form if request.method == 'POST' else request.args
+        link, rpa_id = source.get('link'), source.get('rpa_id')
+        if not link or not rpa_id:
+            return jsonify({"status": "error", "message": "Please provide both a valid link and RPA ID."}), 400
+
+        # The session object itself, so a token refreshed mid-pipeline is saved with the response
+        await get_pipeline().run_pipeline(link, rpa_id, session["access_token"], session._get_current_object())
+
+        return jsonify({"status": "success", "message": "Data sent successfully to Bitrix24!"}), 200
+    except pipeline.ExtractionError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except httpx.HTTPError as e:
+        logging.error(f"Failed to send data: {_error_text(e)}")
+        return jsonify({"status": "error", "message": f"Failed to send data: {_error_text(e)}"}), 500
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {str(e)}"}), 500
+
+def _open_session(flask_request):
+    interface = flask_app.session_interface
+    return interface.open_session(flask_app, flask_request) or interface.make_null_session(flask_app)
+
+async def webhook(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        return
+    environ = build_environ(scope, io.BytesIO(body))
+    flask_request = flask_app.request_class(environ)
+    # The session store reads SQLite, so load the session off the loop and hand it to the context
+    flask_session = await get_pipeline().run_cpu(_open_session, flask_request)
+    # Flask's request context carries the session and form; contextvars keep it per task
+    with RequestContext(flask_app, environ, request=flask_request, session=flask_session):
+        # The stack profiler samples a thread, which the event loop shares between requests, so only time it
+        g.request_start = time.perf_counter()
+        response = flask_app.make_response(await _webhook_response())
+        # after_request hooks (metrics) and the session save, in a copy of this request's context
+        response = await get_pipeline().run_cpu(contextvars.copy_context().run, flask_app.process_response, response)
+        await _send_response(send, response.status_code, response.headers.to_wsgi_list(), response.get_data())
+
+async def lifespan(receive, send):
+    global _pipeline
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            get_pipeline()
+            # A no-op when gunicorn's post_worker_init already did it
+            await asyncio.get_running_loop().run_in_executor(None, pipeline.warm_charts)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _pipeline is not None:
+                await _pipeline.aclose()
+                _pipeline = None
+            shutdown_render_pool()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        scope = _merge_cookies(scope)
+        if scope["path"] == "/webhook" and scope["method"] in ("GET", "POST") and not pipeline.WEBHOOK_ASYNC:
+            await webhook(scope, receive, send)
+        else:
+            await flask_view(scope, receive, send)
@@ -0,0 +1,288 @@
+"""Asyncio implementation of the webhook pipeline.
+
+One event loop per worker carries every in-flight webhook. Report fetches,
+GCS uploads, Bitrix updates and token refreshes go through a pooled ``httpx``
+client with at most ``HTTP_HOST_CONCURRENCY`` calls in flight per upstream
+host, retried with the same policy as ``http_client``. Parsing, scoring, the SQLite caches and
+chart rendering run in a thread pool (charts still render in the chart
+process pool), so a worker waiting on slow upstreams keeps accepting
+requests. The CPU-side steps are the ones in ``app.py``; only the I/O differs.
+
+Requires ``httpx``. ``asgi.py`` serves it.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import httpx
+import app as pipeline
+import http_client
+import metrics
+from charts import chart_points
+from report_parser import parse_report
+
+HTTP_HOST_CONCURRENCY = int(os.getenv('HTTP_HOST_CONCURRENCY', 20))
+ASYNC_CPU_THREADS = int(os.getenv('ASYNC_CPU_THREADS', 8))
+# Same statuses http_client retries
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+GCS_SCOPE = "https://www.googleapis.com/auth/devstorage.read_write"
+
+# httpx logs every request at INFO; outbound calls are already in the metrics
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def _form(data):
+    # requests leaves out None values when form-encoding; httpx would send them as empty strings
+    return {name: value for name, value in data.items() if value is not None}
+
+class AsyncHTTP:
+    """Pooled async HTTP client with a concurrency limit per upstream host.
+
+    Create it inside the event loop that will use it.
+    """
+
+    def __init__(self, host_concurrency=HTTP_HOST_CONCURRENCY):
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(http_client.HTTP_READ_TIMEOUT, connect=http_client.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_keepalive_connections=http_client.HTTP_POOL_SIZE),
+        )
+        self._host_concurrency = host_concurrency
+        self._semaphores = {}
+
+    def host_slot(self, url):
+        """Semaphore bounding concurrent calls to ``url``'s host."""
+        host = urlsplit(url).netloc
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self._host_concurrency)
+        return semaphore
+
+    async def request(self, method, url, service="other", idempotent=True, **kwargs):
+        """Send with http_client's retry policy; exhausted retries return the last response.
+
+        ``idempotent=False`` sends once, like ``http_client.request``.
+        """
+        start = time.perf_counter()
+        retries = http_client.HTTP_RETRIES if idempotent else 0
+        async with self.host_slot(url):
+            for attempt in range(retries + 1):
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    if attempt == retries:
+                        metrics.observe_outbound(service, time.perf_counter() - start, error=e)
+                        raise
+                else:
+                    if response.status_code not in RETRY_STATUSES or attempt == retries:
+                        metrics.observe_outbound(service, time.perf_counter() - start, status=response.status_code)
+                        return response
+                metrics.RETRIES.labels("http").inc()
+                await asyncio.sleep(http_client.HTTP_BACKOFF * 2 ** attempt)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+class AsyncPipeline:
+    """The webhook pipeline on one event loop."""
+
+    def __init__(self, host_concurrency=HTTP_HOST_CONCURRENCY, cpu_threads=ASYNC_CPU_THREADS):
+        self.http = AsyncHTTP(host_concurrency)
+        self.cpu_pool = ThreadPoolExecutor(max_workers=cpu_threads, thread_name_prefix="async-cpu")
+        emulator = os.getenv("STORAGE_EMULATOR_HOST")
+        if emulator and not emulator.startswith("http"):
+            emulator = f"http://{emulator}"
+        self._gcs_url = emulator or "https://storage.googleapis.com"
+        # The emulator takes anonymous requests; GCS gets application default credentials
+        self._gcs_anonymous = bool(emulator)
+        self._gcs_credentials = None
+        self._gcs_credentials_lock = asyncio.Lock()
+
+    async def aclose(self):
+        await self.http.aclose()
+        self.cpu_pool.shutdown(wait=False)
+
+    async def run_cpu(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_pool, func, *args)
+
+    async def _gcs_headers(self):
+        if self._gcs_anonymous:
+            return {}
+        async with self._gcs_credentials_lock:
+            if self._gcs_credentials is None or not self._gcs_credentials.valid:
+                self._gcs_credentials = await self.run_cpu(self._refresh_gcs_credentials, self._gcs_credentials)
+        return {"Authorization": f"Bearer {self._gcs_credentials.token}"}
+
+    @staticmethod
+    def _refresh_gcs_credentials(credentials):
+        import google.auth
+        from google.auth.transport.requests import Request
+        if credentials is None:
+            credentials, _ = google.auth.default(scopes=[GCS_SCOPE])
+        credentials.refresh(Request())
+        return credentials
+
+    async def extract_data_from_url(self, url):
+        try:
+            with metrics.span("scrape"):
+                response = await self.http.request("GET", url, service="report")
+                response.raise_for_status()
+        except httpx.HTTPError as e:
+            logging.error(f"Error extracting data from URL: {e}")
+            return None
+        with metrics.span("parse"):
+            return await self.run_cpu(parse_report, response.content)
+
+    async def upload_to_gcs(self, data, destination_blob_name, content_type="image/png"):
+        """Async counterpart of ``app.upload_to_gcs``: a multipart upload to the GCS JSON API."""
+        if not data:
+            logging.error(f"Nothing to upload for {destination_blob_name}")
+            return None
+
+        url = f"{self._gcs_url}/upload/storage/v1/b/{pipeline.GCS_BUCKET_NAME}/o?uploadType=multipart"
+        boundary = uuid.uuid4().hex
+        metadata = json.dumps({"name": destination_blob_name, "contentType": content_type}).encode()
+        body = b"".join([
+            f"--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n".encode(), metadata,
+            f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n\r\n".encode(), data,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ])
+        # Blob names are content-addressed, so retrying an upload is idempotent
+        with metrics.span("upload"):
+            for attempt in range(1, pipeline.GCS_UPLOAD_RETRIES + 1):
+                start = time.perf_counter()
+                try:
+                    headers = await self._gcs_headers()
+                    headers["Content-Type"] = f"multipart/related; boundary={boundary}"
+                    async with self.http.host_slot(url):
+                        response = await self.http.client.post(url, content=body, headers=headers,
+                                                               timeout=pipeline.GCS_UPLOAD_TIMEOUT)
+                    response.raise_for_status()
+                    metrics.observe_outbound("gcs", time.perf_counter() - start)
+                    metrics.UPLOADED_BYTES.inc(len(data))
+                    return f"https://storage.googleapis.com/{pipeline.GCS_BUCKET_NAME}/{destination_blob_name}"
+                except Exception as e:
+                    metrics.observe_outbound("gcs", time.perf_counter() - start, error=e)
+                    logging.error(f"Error uploading to GCS (attempt {attempt}/{pipeline.GCS_UPLOAD_RETRIES}): {e}")
+                    if attempt < pipeline.GCS_UPLOAD_RETRIES:
+                        metrics.RETRIES.labels("gcs").inc()
+                        await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        metrics.record_failure("upload")
+        return None
+
+    async def render_and_upload_charts(self, name, gender_key, age, measurements, trajectories=None):
+        """Render in the thread pool, then upload every chart concurrently."""
+        if pipeline.CHART_LAYOUT == "composite":
+            keys = [key for key, *_ in chart_points(age, measurements, trajectories)]
+            image, manifest = await self.run_cpu(pipeline.rendered_composite, gender_key, age, measurements,
+                                                 trajectories)
+            if not image:
+                logging.error("Failed to render the composite chart")
+                metrics.record_failure("render")
+                return dict.fromkeys(keys)
+            uploads = pipeline.composite_uploads(name, image, manifest)
+            links = await asyncio.gather(*(self.upload_to_gcs(data, blob_name, content_type)
+                                           for blob_name, data, content_type in uploads))
+            return pipeline.composite_links(keys, uploads, links)
+
+        rendered = await self.run_cpu(
+            lambda: list(pipeline.rendered_charts(gender_key, age, measurements, trajectories)))
+        extension, content_type = pipeline.CHART_FORMATS[pipeline.chart_format()]
+        uploads = {}
+        for key, image in rendered:
+            if image:
+                blob_name = pipeline.chart_blob_name(name, key, image, extension)
+                uploads[key] = self.upload_to_gcs(image, blob_name, content_type)
+            else:
+                metrics.record_failure("render")
+        links = dict(zip(uploads, await asyncio.gather(*uploads.values())))
+        return pipeline.chart_links([key for key, _ in rendered], links)
+
+    async def compute_report(self, extracted_data, child, digest):
+        visit = await self.run_cpu(pipeline.score_visit, extracted_data, child, digest)
+        with metrics.span("charts"):
+            gcs_links = await self.render_and_upload_charts(extracted_data['name'], visit["sex"], visit["age"],
+                                                            visit["chart_measurements"], visit["chart_series"])
+        return pipeline.finish_report(extracted_data, child, visit, gcs_links)
+
+    async def build_report(self, link, rpa_id):
+        """Async counterpart of ``app.build_report``."""
+        modified_link = pipeline.modify_url(link)
+        digest, report = await self.run_cpu(pipeline.cached_report, modified_link, rpa_id)
+        cached = report is not None
+        if not cached:
+            extracted_data = await self.extract_data_from_url(modified_link)
+            if not extracted_data:
+                raise pipeline.ExtractionError("Failed to extract data from the provided link.")
+            child, digest = pipeline.report_identity(extracted_data, rpa_id)
+            report = await self.run_cpu(pipeline.result_cache.get_by_digest, digest)
+            cached = report is not None
+            if not cached:
+                report = await self.compute_report(extracted_data, child, digest)
+            await self.run_cpu(pipeline.store_report, modified_link, digest, report)
+        return pipeline.report_update(rpa_id, report, cached)
+
+    async def refresh_bitrix_token(self, refresh_token):
+        url = f"{pipeline.BITRIX_OAUTH_URL}/oauth/token/"
+        data = {
+            'grant_type': 'refresh_token',
+            'client_id': pipeline.CLIENT_ID,
+            'client_secret': pipeline.CLIENT_SECRET,
+            'refresh_token': refresh_token
+        }
+        # Codes and refresh tokens are single-use, so a lost response must not be replayed
+        response = await self.http.request("POST", url, service="bitrix_oauth", idempotent=False, data=_form(data))
+        if response.status_code == 200:
+            return response.json()
+        logging.error(f"Failed to refresh token: {response.text}")
+        return None
+
+    async def refresh_access_token(self, refresh_token):
+        """Refresh through ``app.token_refreshes``, sharing a refresh already in flight on any thread or task.
+
+        The single-flight blocks its callers, so it runs on the thread pool; the
+        leader's HTTP call itself is scheduled back onto this loop.
+        """
+        if not refresh_token:
+            return None
+        loop = asyncio.get_running_loop()
+
+        def refresh():
+            return asyncio.run_coroutine_threadsafe(self.refresh_bitrix_token(refresh_token), loop).result()
+
+        return await self.run_cpu(pipeline.token_refreshes.do, refresh_token, refresh)
+
+    async def _post_rpa_update(self, query_params, access_token):
+        headers = {
+            'Authorization': f'Bearer {access_token}'
+        }
+        return await self.http.request("POST", pipeline.RPA_UPDATE_URL, service="bitrix",
+                                       data=_form(query_params), headers=headers)
+
+    async def send_rpa_update(self, query_params, access_token, session=None):
+        """Update the RPA item; with a ``session``, an expired access token is refreshed once and the update retried."""
+        with metrics.span("bitrix_update"):
+            response = await self._post_rpa_update(query_params, access_token)
+            if response.status_code == 401 and session is not None:
+                logging.warning("Access token expired. Attempting to refresh...")
+                token_data = await self.refresh_access_token(session.get('refresh_token'))
+                if token_data:
+                    pipeline.store_tokens(session, token_data)
+                    response = await self._post_rpa_update(query_params, token_data['access_token'])
+                else:
+                    logging.error("Token refresh failed")
+            response.raise_for_status()
+        return response
+
+    async def run_pipeline(self, link, rpa_id, access_token, session=None):
+        query_params, summary = await self.build_report(link, rpa_id)
+        summary["update_skipped"] = await self.run_cpu(pipeline.result_cache.update_unchanged, rpa_id, query_params)
+        if summary["update_skipped"]:
+            logging.info(f"RPA item {rpa_id} already has these values; skipping the Bitrix update")
+            metrics.BITRIX_UPDATES_SKIPPED.inc()
+        else:
+            await self.send_rpa_update(query_params, access_token, session)
+            await self.run_cpu(pipeline.result_cache.mark_sent, rpa_id, query_params)
+        return summary
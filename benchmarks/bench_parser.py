@@ -0,0 +1,83 @@
+"""Benchmark report-page parsing against the saved fixtures.
+
+Compares the legacy repeated-``find_all`` extraction with ``parse_report`` on
+every backend available, and checks that all of them return the same values
+for the fields the legacy extraction knows (``parse_report`` adds more).
+
+    python benchmarks/bench_parser.py [--repeat 50]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import report_parser  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "*.html")
+
+def legacy_extract(content):
+    # extract_data_from_url() body before the single-pass parser
+    soup = BeautifulSoup(content, 'html.parser')
+
+    data_texts = soup.find_all("div", {"class": "data-text font-size-nom bold"})
+    box_texts = soup.find_all("div", {"class": "box"})
+    td_center_spans = soup.find_all("div", {"class": "td t-center", "style": "width:55%; text-align: right;"})
+
+    return {
+        "name": soup.find("span", {"class": "name abs"}).text.strip() if soup.find("span", {"class": "name abs"}) else "Unknown",
+        "age": soup.find("span", {"class": "old abs"}).text.strip() if soup.find("span", {"class": "old abs"}) else "0",
+        "gender": soup.find("span", {"class": "sex abs"}).text.strip() if soup.find("span", {"class": "sex abs"}) else "Unknown",
+        "height": soup.find("span", {"class": "height abs"}).text.strip() if soup.find("span", {"class": "height abs"}) else "0 cm",
+        "weight": data_texts[0].text.strip() if len(data_texts) > 0 else "0",
+        "smm": data_texts[1].text.strip() if len(data_texts) > 1 else "0",
+        "bmi": data_texts[3].text.strip() if len(data_texts) > 3 else "0",
+        "pbf": data_texts[4].text.strip() if len(data_texts) > 4 else "0",
+        "score": box_texts[0].text.strip() if len(box_texts) > 0 else "0",
+        "ecf": soup.find_all("div", {"class": "bold"})[1].text.strip(),
+        "cf": soup.find_all("div", {"class": "bold"})[2].text.strip(),
+        "protein": soup.find_all("div", {"class": "bold"})[3].text.strip(),
+        "minerals": soup.find_all("div", {"class": "bold"})[4].text.strip(),
+        "fat": soup.find_all("div", {"class": "bold"})[5].text.strip(),
+        "body_water": soup.find_all("div", {"class": "bold"})[6].text.strip(),
+        "soft_lean_mass": soup.find_all("div", {"class": "bold"})[7].text.strip(),
+        "fat_free_mass": soup.find_all("div", {"class": "bold"})[8].text.strip(),
+        "body_fat_mass": data_texts[2].text.strip() if len(data_texts) > 2 else "0",
+        "basal_metabolic_rate": td_center_spans[0].find("span").text.strip() if len(td_center_spans) > 0 else "0",
+        "bone_mineral": td_center_spans[1].find("span").text.strip() if len(td_center_spans) > 1 else "0",
+        "waist_hip_ratio": td_center_spans[2].find("span").text.strip() if len(td_center_spans) > 2 else "0",
+        "visceral_fat_level": td_center_spans[3].find("span").text.strip() if len(td_center_spans) > 3 else "0",
+    }
+
+def timed(func, content, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(content)
+    return (time.perf_counter() - start) / repeat, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    candidates = {
+        "legacy": legacy_extract,
+        "stream": lambda content: report_parser.parse_report(content, backend="stream"),
+    }
+    if report_parser.lxml is not None:
+        candidates["lxml"] = lambda content: report_parser.parse_report(content, backend="lxml")
+
+    for path in sorted(glob.glob(FIXTURES)):
+        with open(path, "rb") as fixture:
+            content = fixture.read()
+        print(f"{os.path.basename(path)} ({len(content) / 1024:.1f} KiB)")
+        baseline_time, expected = timed(legacy_extract, content, args.repeat)
+        for label, func in candidates.items():
+            elapsed, result = (baseline_time, expected) if label == "legacy" else timed(func, content, args.repeat)
+            status = "ok" if {field: result.get(field) for field in expected} == expected else "MISMATCH"
+            print(f"  {label:<12} {elapsed * 1000:8.2f} ms  x{baseline_time / elapsed:5.1f}  {status}")
+
+if __name__ == "__main__":
+    main()
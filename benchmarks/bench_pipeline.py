@@ -0,0 +1,255 @@
+"""End-to-end benchmark of the /webhook pipeline under gunicorn.
+
+Starts the local stand-ins from ``fake_services.py`` (Bitrix OAuth/REST, the
+report site and a GCS JSON API endpoint), boots the app under gunicorn pointed
+at them, logs in through ``/oauth/callback`` and fires ``--requests`` webhook
+calls at ``--concurrency``. Each call is split into stages using the times the
+fakes saw its report fetch, chart uploads and RPA update:
+
+    scrape    request sent -> report page served
+    charts    report page served -> first chart upload received
+    upload    first upload received -> last upload answered
+    bitrix    last upload answered -> RPA update received
+    response  RPA update received -> webhook response received
+
+Results (percentiles per stage, throughput, configuration and commit) are
+written as JSON under ``benchmarks/results/``; ``--compare`` prints the change
+against an earlier results file.
+
+    python benchmarks/bench_pipeline.py --workers 2 --concurrency 8 --requests 200
+    python benchmarks/bench_pipeline.py --chart-backend svg --compare benchmarks/results/<earlier>.json
+    python benchmarks/bench_pipeline.py --chart-layout composite --latency 0.05
+    python benchmarks/bench_pipeline.py --server asgi --workers 1 --concurrency 48 --latency 0.5
+"""
+import argparse
+import glob
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import requests
+
+from fake_services import FakeServices
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+FIXTURES = os.path.join(BENCH_DIR, "fixtures", "*.html")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+STAGES = ("scrape", "charts", "upload", "bitrix", "response", "total")
+PERCENTILES = (50, 90, 95, 99)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_app(args, services, port, workdir):
+    env = dict(
+        os.environ,
+        BITRIX_OAUTH_URL=services.url,
+        BITRIX_PORTAL_URL=services.url,
+        BITRIX_WEBHOOK_URL=f"{services.url}/rest/1/bench",
+        BITRIX_CLIENT_ID="bench",
+        BITRIX_CLIENT_SECRET="bench",
+        STORAGE_EMULATOR_HOST=services.url,
+        GCS_BUCKET_NAME="bench-charts",
+        UPLOAD_FOLDER=os.path.join(workdir, "charts"),
+        DOWNLOAD_FOLDER=os.path.join(workdir, "downloads"),
+        # A fresh result cache and history per run, so every call goes through the whole pipeline
+        RESULT_CACHE_PATH=os.path.join(workdir, "results.db"),
+        HISTORY_DB_PATH=os.path.join(workdir, "history.db"),
+        WEBHOOK_JOB_DB_PATH=os.path.join(workdir, "jobs.db"),
+        CHART_BACKEND=args.chart_backend,
+        CHART_LAYOUT=args.chart_layout,
+    )
+    if args.render_workers is not None:
+        env["CHART_RENDER_WORKERS"] = str(args.render_workers)
+    if args.server == "asgi":
+        server = ["asgi:application", "--worker-class", "uvicorn.workers.UvicornWorker"]
+    else:
+        server = ["app:app", "--worker-class", "gthread", "--threads", str(args.threads)]
+    command = [
+        sys.executable, "-m", "gunicorn", *server,
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(args.workers),
+        "--timeout", "120",
+        "--log-level", "warning",
+    ]
+    log = open(os.path.join(workdir, "gunicorn.log"), "w")
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT), log
+
+def wait_for_app(app_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            requests.get(f"{app_url}/jobs/ready", timeout=1)
+            return
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            # The socket accepts before the worker has warmed its charts
+            time.sleep(0.2)
+    raise RuntimeError(f"app did not come up within {timeout}s")
+
+def login(app_url):
+    client = requests.Session()
+    response = client.get(f"{app_url}/oauth/callback", params={"code": "bench"}, timeout=30)
+    response.raise_for_status()
+    if not client.cookies:
+        raise RuntimeError("login through /oauth/callback did not set a session cookie")
+    return client.cookies
+
+def run_load(app_url, services, cookies, numbers, concurrency):
+    local = threading.local()
+
+    def call(number):
+        if not hasattr(local, "client"):
+            local.client = requests.Session()
+            local.client.cookies.update(cookies)
+        sent = time.perf_counter()
+        try:
+            response = local.client.post(f"{app_url}/webhook", timeout=300, data={
+                "link": f"{services.url}/report/{number}",
+                "rpa_id": str(number),
+            })
+            status = response.status_code
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+        return number, sent, time.perf_counter(), status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(call, numbers))
+
+def stage_timings(calls, events):
+    seen = defaultdict(dict)
+    for number, event, stamp, _size in events:
+        marks = seen[number]
+        if event == "upload_started":
+            marks["first_upload"] = min(stamp, marks.get("first_upload", stamp))
+        elif event == "upload_finished":
+            marks["last_upload"] = max(stamp, marks.get("last_upload", stamp))
+        else:
+            marks[event] = stamp
+
+    timings = defaultdict(list)
+    for number, sent, done, status in calls:
+        if status != 200:
+            continue
+        marks = dict(seen[number], sent=sent, done=done)
+        boundaries = ("sent", "report_served", "first_upload", "last_upload", "bitrix_updated", "done")
+        for stage, (start, end) in zip(STAGES, zip(boundaries, boundaries[1:])):
+            if start in marks and end in marks:
+                timings[stage].append(marks[end] - marks[start])
+        timings["total"].append(done - sent)
+    return timings
+
+def summarize(samples):
+    if not samples:
+        return None
+    values = np.asarray(samples) * 1000
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    summary.update(mean=round(float(values.mean()), 2), max=round(float(values.max()), 2), count=len(samples))
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    print(f"{results['requests']} requests, {results['errors']} errors, "
+          f"{results['throughput_rps']:.2f} req/s over {results['duration_s']:.1f}s")
+    print(f"  {'stage':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage in STAGES:
+        summary = results["stages"].get(stage)
+        if not summary:
+            continue
+        line = f"  {stage:<10}{summary['p50']:>10.1f}{summary['p95']:>10.1f}{summary['p99']:>10.1f}{summary['max']:>10.1f}"
+        before = (baseline or {}).get("stages", {}).get(stage)
+        if before and before["p50"]:
+            line += f"   p50 x{summary['p50'] / before['p50']:.2f} vs {baseline.get('commit') or 'baseline'}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--server", default="gthread", choices=("gthread", "asgi"),
+                        help="gthread workers running app:app, or uvicorn workers running asgi:application")
+    parser.add_argument("--threads", type=int, default=4, help="gthread threads per worker")
+    parser.add_argument("--concurrency", type=int, default=8, help="webhook calls in flight")
+    parser.add_argument("--requests", type=int, default=100, help="measured webhook calls")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured calls before the run")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake services wait per call")
+    parser.add_argument("--chart-backend", default="matplotlib", choices=("matplotlib", "svg", "svg-png"))
+    parser.add_argument("--chart-layout", default="separate", choices=("separate", "composite"))
+    parser.add_argument("--render-workers", type=int, help="CHART_RENDER_WORKERS for the app")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/pipeline-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    with open(sorted(glob.glob(FIXTURES))[0], "rb") as fixture:
+        services = FakeServices(fixture.read(), latency=args.latency).start()
+    port = free_port()
+    app_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as workdir:
+        process, log = start_app(args, services, port, workdir)
+        try:
+            wait_for_app(app_url, process)
+            cookies = login(app_url)
+            run_load(app_url, services, cookies, range(args.warmup), args.concurrency)
+            services.events.drain()
+
+            started = time.perf_counter()
+            calls = run_load(app_url, services, cookies, range(args.warmup, args.warmup + args.requests),
+                             args.concurrency)
+            duration = time.perf_counter() - started
+            events = services.events.drain()
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            log.close()
+            services.stop()
+
+    statuses = defaultdict(int)
+    for _number, _sent, _done, status in calls:
+        statuses[str(status)] += 1
+    timings = stage_timings(calls, events)
+    results = {
+        "benchmark": "pipeline",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "requests": len(calls),
+        "errors": len(calls) - statuses.get("200", 0),
+        "status_codes": dict(statuses),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(calls) / duration, 3) if duration else None,
+        "uploaded_bytes": sum(size for _number, event, _stamp, size in events if event == "upload_finished"),
+        "stages": {stage: summarize(timings.get(stage, [])) for stage in STAGES},
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
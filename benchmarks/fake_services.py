@@ -0,0 +1,142 @@
+"""Local stand-ins for the services the pipeline talks to.
+
+One threaded HTTP server plays the Bitrix OAuth server, the Bitrix REST API,
+the report site and the Google Cloud Storage JSON API (the storage client
+talks to it through ``STORAGE_EMULATOR_HOST``). Every request is recorded with
+a ``time.perf_counter()`` timestamp and the benchmark request it belongs to, so
+the harness can split end-to-end latency into pipeline stages.
+
+Report pages are served from the recorded fixtures with the child's name
+replaced by ``bench-<n>`` for ``/report/<n>``; that name ends up in the chart
+blob names and ``rpa_id`` carries ``n`` to Bitrix, tying every call back to
+the request that caused it.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ACCESS_TOKEN = "bench-access-token"
+REFRESH_TOKEN = "bench-refresh-token"
+NAME_SPAN = re.compile(rb'(<span class="name abs">)[^<]*(</span>)')
+BLOB_NAME = re.compile(rb'"name"\s*:\s*"((?:bench-(\d+)_)?[^"]*)"')
+
+class EventLog:
+    """Thread-safe record of (request number, event, timestamp, bytes)."""
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+
+    def record(self, number, event, size=0):
+        with self._lock:
+            self._events.append((number, event, time.perf_counter(), size))
+
+    def drain(self):
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+class FakeServices(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixture, latency=0.0, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.fixture = fixture
+        self.latency = latency
+        self.events = EventLog()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-services", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, each keep-alive call stalls ~40 ms on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _authorized(self):
+        return self.headers.get("Authorization") == f"Bearer {ACCESS_TOKEN}"
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        self._delay()
+        path = urlsplit(self.path).path
+        if path.startswith("/report/"):
+            number = path.rsplit("/", 1)[-1]
+            page = NAME_SPAN.sub(rb"\g<1>bench-" + number.encode() + rb"\g<2>", self.server.fixture)
+            self._send(200, page, "text/html; charset=utf-8")
+            self.server.events.record(int(number), "report_served")
+        elif path == "/rest/user.current":
+            if self._authorized():
+                self._send(200, {"result": {"ID": "1", "NAME": "Bench"}})
+            else:
+                self._send(401, {"error": "expired_token"})
+        else:
+            self._send(404, {"error": "not_found"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._body()
+        if path.startswith("/upload/storage/v1/b/"):
+            self._upload(path, body)
+            return
+        self._delay()
+        if path == "/oauth/token/":
+            self._send(200, {"access_token": ACCESS_TOKEN, "refresh_token": REFRESH_TOKEN, "expires_in": 3600})
+        elif path.endswith("/rpa.item.update.json"):
+            if not self._authorized():
+                self._send(401, {"error": "expired_token"})
+                return
+            rpa_id = parse_qs(body.decode()).get("id", ["0"])[0]
+            self._send(200, {"result": {"item": {"id": rpa_id}}})
+            self.server.events.record(int(rpa_id), "bitrix_updated")
+        elif path.endswith("/batch.json"):
+            commands = [key for key in parse_qs(body.decode()) if key.startswith("cmd[")]
+            results = {key[4:-1]: {"item": {}} for key in commands}
+            self._send(200, {"result": {"result": results, "result_error": {}}})
+        else:
+            self._send(404, {"error": "not_found"})
+
+    def _upload(self, path, body):
+        # Multipart upload from the storage client: JSON metadata part, then the object
+        match = BLOB_NAME.search(body)
+        name = match.group(1).decode() if match else ""
+        number = int(match.group(2)) if match and match.group(2) else -1
+        self.server.events.record(number, "upload_started")
+        self._delay()
+        bucket = path.split("/")[5]
+        self._send(200, {"bucket": bucket, "name": name, "size": str(len(body))})
+        self.server.events.record(number, "upload_finished", len(body))
@@ -0,0 +1,457 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+REFERENCE_CURVES = ["3rd Percentile", "15th Percentile", "50th Percentile", "85th Percentile", "97th Percentile",
+                    "-3SD Z-Scores", "-2SD Z-Scores", "-1SD Z-Scores", "Median Z-Scores",
+                    "1SD Z-Scores", "2SD Z-Scores", "3SD Z-Scores", "3rd Z-Scores",
+                    "15th Z-Scores", "Median Z Scores", "85th Z-Scores", "97th Z-Scores", "Median Velocity"]
+
+# Chart key -> reference table, measurement and labels
+CHART_SPECS = {
+    "bmi_chart_per": {"table": "bmifa", "kind": "per", "measure": "bmi", "label": "BMI", "title": "BMI Chart"},
+    "bmi_chart_z": {"table": "bmifa", "kind": "z", "measure": "bmi", "label": "BMI Z-Score", "title": "BMI Z-Score Chart"},
+    "height_chart_per": {"table": "hfa", "kind": "per", "measure": "height", "label": "Height (cm)", "title": "Height Chart"},
+    "height_chart_z": {"table": "hfa", "kind": "z", "measure": "height", "label": "Height Z-Score", "title": "Height Z-Score Chart"},
+    "weight_chart_per": {"table": "wfa", "kind": "per", "measure": "weight", "label": "Weight (kg)", "title": "Weight Chart"},
+    "weight_chart_z": {"table": "wfa", "kind": "z", "measure": "weight", "label": "Weight Z-Score", "title": "Weight Z-Score Chart"},
+}
+# Velocity charts need at least two visits, so they are rendered only when the child has a history
+VELOCITY_CHART_SPECS = {
+    # The median curve alone spans a few units, so the axes are fixed wide enough for real children
+    "height_velocity": {"table": "hvel", "kind": "per", "measure": "height_velocity", "ylim": (-2, 16),
+                        "label": "Height velocity (cm/year)", "title": "Height Velocity Chart"},
+    "weight_velocity": {"table": "wvel", "kind": "per", "measure": "weight_velocity", "ylim": (-6, 16),
+                        "label": "Weight velocity (kg/year)", "title": "Weight Velocity Chart"},
+}
+ALL_CHART_SPECS = {**CHART_SPECS, **VELOCITY_CHART_SPECS}
+CHART_SEXES = ("boys", "girls")
+# Figure size of one chart, in inches at the default 100 dpi
+PANEL_SIZE = (6, 8)
+# Composite layout: one row per chart kind, one column per measure; velocity charts add a row
+COMPOSITE_ROWS = (
+    ("bmi_chart_per", "height_chart_per", "weight_chart_per"),
+    ("bmi_chart_z", "height_chart_z", "weight_chart_z"),
+)
+COMPOSITE_VELOCITY_ROW = ("height_velocity", "weight_velocity")
+TRAJECTORY_STYLE = {"color": "black", "marker": "o", "markersize": 3, "linewidth": 1}
+# Drawn in place of the child's point when their age has no reference
+NOTE_STYLE = {"ha": "center", "va": "center", "color": "darkred", "zorder": 6,
+              "bbox": {"boxstyle": "round", "facecolor": "white", "edgecolor": "darkred"}}
+
+def _pyplot():
+    # matplotlib is imported on first render so workers boot without it
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+# pyplot's current-figure state is global, so fallback renders from pool threads take turns
+_pyplot_lock = threading.Lock()
+
+def plot_growth_chart(data, age, metric, metric_label, title, output, trajectory=None):
+    with _pyplot_lock:
+        _plot_growth_chart(data, age, metric, metric_label, title, output, trajectory)
+
+def _plot_growth_chart(data, age, metric, metric_label, title, output, trajectory):
+    try:
+        plt = _pyplot()
+        plt.figure(figsize=PANEL_SIZE)
+        for col in REFERENCE_CURVES:
+            if col in data:
+                plt.plot(data["Age (years)"], data[col], label=col)
+
+        if trajectory:
+            plt.plot(*zip(*trajectory), label="Child's History", zorder=4, **TRAJECTORY_STYLE)
+        if metric is None:
+            plt.text(0.5, 0.5, range_note(data, age), transform=plt.gca().transAxes, **NOTE_STYLE)
+        else:
+            plt.scatter([age], [metric], color="red", label="Child's Data", zorder=5)
+        plt.title(title)
+        plt.xlabel("Age (years)")
+        plt.ylabel(metric_label)
+        plt.legend()
+        plt.grid(True)
+        plt.savefig(output, format="png")
+        plt.close()
+    except Exception as e:
+        logging.error(f"Error in plot_growth_chart: {e}")
+
+def _age_label(age):
+    years, months = divmod(int(round(age * 12)), 12)
+    return f"{years} y {months} m"
+
+def range_note(data, age):
+    """Text shown instead of the child's point when ``age`` is outside the chart's reference."""
+    ages = np.asarray(data.get("Age (years)", ()), dtype=float)
+    ages = ages[~np.isnan(ages)]
+    if not len(ages):
+        return f"No WHO reference for age {_age_label(age)}"
+    return (f"Age {_age_label(age)} is outside the WHO reference\n"
+            f"range ({_age_label(ages.min())} \u2013 {_age_label(ages.max())})")
+
+def _draw_panel(ax, data, metric_label, title, ylim=None):
+    """Draw one chart's reference curves on ``ax``; returns its animated (point, trail, note)."""
+    from matplotlib.lines import Line2D
+
+    for col in REFERENCE_CURVES:
+        if col in data:
+            ax.plot(data["Age (years)"], data[col], label=col)
+
+    # The child's marker and history are animated so they stay out of the cached background
+    point = ax.scatter([], [], color="red", zorder=5, animated=True)
+    trail, = ax.plot([], [], zorder=4, animated=True, **TRAJECTORY_STYLE)
+    note = ax.text(0.5, 0.5, "", transform=ax.transAxes, animated=True, **NOTE_STYLE)
+    handles, labels = ax.get_legend_handles_labels()
+    handles.append(Line2D([], [], **TRAJECTORY_STYLE))
+    labels.append("Child's History")
+    handles.append(Line2D([], [], marker="o", color="red", linestyle="None"))
+    labels.append("Child's Data")
+    ax.set_title(title)
+    ax.set_xlabel("Age (years)")
+    ax.set_ylabel(metric_label)
+    ax.legend(handles, labels)
+    ax.grid(True)
+    if ylim:
+        ax.set_ylim(*ylim)
+    ax.set_autoscale_on(False)
+    return point, trail, note
+
+def _build_background(data, metric_label, title, ylim=None):
+    _pyplot()
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=PANEL_SIZE)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    point, trail, note = _draw_panel(ax, data, metric_label, title, ylim)
+
+    canvas.draw()
+    return {
+        "data": data,
+        "canvas": canvas,
+        "ax": ax,
+        "point": point,
+        "trail": trail,
+        "note": note,
+        "background": canvas.copy_from_bbox(fig.bbox),
+        "xlim": ax.get_xlim(),
+        "ylim": ax.get_ylim(),
+        "lock": threading.Lock(),
+    }
+
+def build_chart_backgrounds(reference_data):
+    """Render every chart's reference curves once, keyed by (chart key, sex)."""
+    backgrounds = {}
+    for chart_key, spec in ALL_CHART_SPECS.items():
+        for sex in CHART_SEXES:
+            data = reference_data.get(f"{spec['table']}_{sex}_{spec['kind']}")
+            if not data:
+                continue
+            try:
+                backgrounds[(chart_key, sex)] = _build_background(data, spec["label"], spec["title"], spec.get("ylim"))
+            except Exception as e:
+                logging.error(f"Error rendering background for {chart_key} ({sex}): {e}")
+    return backgrounds
+
+_backgrounds = None
+_backgrounds_lock = threading.Lock()
+
+def get_chart_backgrounds(reference_data):
+    """Build the cached backgrounds on first use in this process."""
+    global _backgrounds
+    with _backgrounds_lock:
+        if _backgrounds is None:
+            _backgrounds = build_chart_backgrounds(reference_data)
+        return _backgrounds
+
+def _in_view(background, age, metric):
+    (x0, x1), (y0, y1) = background["xlim"], background["ylim"]
+    # A point with no value is drawn as a note, which always fits
+    return metric is None or (x0 <= age <= x1 and y0 <= metric <= y1)
+
+def render_growth_chart(backgrounds, chart_key, sex, age, metric, trajectory=None):
+    """Render one chart and return its PNG bytes, or None on failure.
+
+    ``trajectory`` is the child's ``(age, value)`` history, drawn as a line
+    under the highlighted point.
+    """
+    spec = ALL_CHART_SPECS[chart_key]
+    background = backgrounds.get((chart_key, sex))
+    trajectory = tuple(tuple(point) for point in trajectory or ())
+    buffer = io.BytesIO()
+    if background is None or not all(_in_view(background, *point) for point in trajectory + ((age, metric),)):
+        # Points off the cached axes need the autoscaled full render
+        data = background["data"] if background else {}
+        plot_growth_chart(data, age, metric, spec["label"], spec["title"], buffer, trajectory)
+        return buffer.getvalue() or None
+    try:
+        from matplotlib.image import imsave
+        with background["lock"]:
+            canvas = background["canvas"]
+            canvas.restore_region(background["background"])
+            if trajectory:
+                background["trail"].set_data(*zip(*trajectory))
+                background["ax"].draw_artist(background["trail"])
+            if metric is None:
+                background["note"].set_text(range_note(background["data"], age))
+                background["ax"].draw_artist(background["note"])
+            else:
+                background["point"].set_offsets([[age, metric]])
+                background["ax"].draw_artist(background["point"])
+            imsave(buffer, np.asarray(canvas.buffer_rgba()), format="png", dpi=canvas.figure.dpi)
+        return buffer.getvalue()
+    except Exception as e:
+        logging.error(f"Error in render_growth_chart: {e}")
+        return None
+
+def composite_rows(chart_keys):
+    """Panel rows of the composite image holding ``chart_keys``."""
+    if any(key in chart_keys for key in COMPOSITE_VELOCITY_ROW):
+        return COMPOSITE_ROWS + (COMPOSITE_VELOCITY_ROW,)
+    return COMPOSITE_ROWS
+
+def composite_regions(rows, panel_width, panel_height):
+    """Pixel crop region of every panel, with the origin at the top left of the image."""
+    return {
+        key: {"x": column * panel_width, "y": row * panel_height, "width": panel_width, "height": panel_height}
+        for row, keys in enumerate(rows)
+        for column, key in enumerate(keys)
+    }
+
+def _build_composite(reference_data, sex, rows):
+    """Draw the reference curves of every panel in ``rows`` into one figure.
+
+    Each panel sits in its own cell with a standalone chart's margins, so a
+    crop of the cell matches the chart rendered on its own.
+    """
+    _pyplot()
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    columns = max(len(keys) for keys in rows)
+    fig = Figure(figsize=(PANEL_SIZE[0] * columns, PANEL_SIZE[1] * len(rows)))
+    canvas = FigureCanvasAgg(fig)
+    params = fig.subplotpars
+    panels = {}
+    for row, keys in enumerate(rows):
+        for column, key in enumerate(keys):
+            spec = ALL_CHART_SPECS[key]
+            ax = fig.add_axes([
+                (column + params.left) / columns,
+                (len(rows) - 1 - row + params.bottom) / len(rows),
+                (params.right - params.left) / columns,
+                (params.top - params.bottom) / len(rows),
+            ])
+            data = reference_data.get(f"{spec['table']}_{sex}_{spec['kind']}") or {}
+            point, trail, note = _draw_panel(ax, data, spec["label"], spec["title"], spec.get("ylim"))
+            panels[key] = {"ax": ax, "data": data, "point": point, "trail": trail, "note": note}
+    width, height = (int(round(size * fig.dpi)) for size in PANEL_SIZE)
+    return {
+        "canvas": canvas,
+        "panels": panels,
+        "regions": composite_regions(rows, width, height),
+        "lock": threading.Lock(),
+    }
+
+_composites = {}
+_composites_lock = threading.Lock()
+
+def get_composite_background(reference_data, sex, rows):
+    """The cached composite background for ``(sex, rows)``, built on first use in this process."""
+    with _composites_lock:
+        composite = _composites.get((sex, rows))
+        if composite is None:
+            composite = _build_composite(reference_data, sex, rows)
+            composite["canvas"].draw()
+            composite["background"] = composite["canvas"].copy_from_bbox(composite["canvas"].figure.bbox)
+            for panel in composite["panels"].values():
+                panel["xlim"], panel["ylim"] = panel["ax"].get_xlim(), panel["ax"].get_ylim()
+            _composites[(sex, rows)] = composite
+        return composite
+
+def _panel_in_view(panel, points):
+    (x0, x1), (y0, y1) = panel["xlim"], panel["ylim"]
+    return all(y is None or (x0 <= x <= x1 and y0 <= y <= y1) for x, y in points)
+
+def _render_composite_fallback(reference_data, sex, rows, points):
+    # Points off the cached axes get a one-off figure with every panel autoscaled to its points
+    composite = _build_composite(reference_data, sex, rows)
+    for key, age, metric, trajectory in points:
+        panel = composite["panels"][key]
+        ax = panel["ax"]
+        if trajectory:
+            panel["trail"].set_data(*zip(*trajectory))
+            panel["trail"].set_animated(False)
+        datalim = list(trajectory or ())
+        if metric is None:
+            panel["note"].set_text(range_note(panel["data"], age))
+            panel["note"].set_animated(False)
+        else:
+            panel["point"].set_offsets([[age, metric]])
+            panel["point"].set_animated(False)
+            datalim.append((age, metric))
+        if datalim:
+            ax.update_datalim(datalim)
+        ax.set_autoscale_on(True)
+        ax.autoscale_view()
+    composite["canvas"].draw()
+    return composite
+
+def render_composite_chart(reference_data, sex, points):
+    """Render every chart in ``points`` as a panel of one PNG.
+
+    ``points`` are ``(chart key, age, value, trajectory)`` as yielded by
+    ``chart_points``. Returns ``(png bytes, manifest)``, where the manifest
+    maps each chart key to its crop region, or ``(None, None)`` on failure.
+    """
+    points = [(key, age, metric, tuple(tuple(p) for p in trajectory or ())) for key, age, metric, trajectory in points]
+    rows = composite_rows([key for key, *_ in points])
+    try:
+        composite = get_composite_background(reference_data, sex, rows)
+        with composite["lock"]:
+            in_view = all(_panel_in_view(composite["panels"][key], trajectory + ((age, metric),))
+                          for key, age, metric, trajectory in points)
+            if in_view:
+                canvas = composite["canvas"]
+                canvas.restore_region(composite["background"])
+                # One blit pass over all panels
+                for key, age, metric, trajectory in points:
+                    panel = composite["panels"][key]
+                    if trajectory:
+                        panel["trail"].set_data(*zip(*trajectory))
+                        panel["ax"].draw_artist(panel["trail"])
+                    if metric is None:
+                        panel["note"].set_text(range_note(panel["data"], age))
+                        panel["ax"].draw_artist(panel["note"])
+                    else:
+                        panel["point"].set_offsets([[age, metric]])
+                        panel["ax"].draw_artist(panel["point"])
+                image, size = _encode_png(canvas)
+        if not in_view:
+            image, size = _encode_png(_render_composite_fallback(reference_data, sex, rows, points)["canvas"])
+    except Exception as e:
+        logging.error(f"Error in render_composite_chart: {e}")
+        return None, None
+    return image, {"width": size[0], "height": size[1], "panels": composite["regions"]}
+
+def _encode_png(canvas):
+    from matplotlib.image import imsave
+    buffer = io.BytesIO()
+    imsave(buffer, np.asarray(canvas.buffer_rgba()), format="png", dpi=canvas.figure.dpi)
+    return buffer.getvalue(), canvas.get_width_height()
+
+# Per-process state for the chart render pool
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_worker_reference_data = {}
+
+def _init_render_worker(reference_data, composite=False):
+    global _worker_reference_data
+    _worker_reference_data = reference_data
+    if composite:
+        for sex in CHART_SEXES:
+            get_composite_background(reference_data, sex, COMPOSITE_ROWS)
+    else:
+        get_chart_backgrounds(reference_data)
+
+def _render_in_worker(chart_key, sex, age, metric, trajectory=None):
+    return render_growth_chart(get_chart_backgrounds(_worker_reference_data), chart_key, sex, age, metric, trajectory)
+
+def _render_composite_in_worker(sex, points):
+    return render_composite_chart(_worker_reference_data, sex, points)
+
+def _warm_worker():
+    # The initializer has already built the backgrounds by the time this runs
+    return os.getpid()
+
+def get_render_pool(reference_data, workers, composite=False):
+    """Lazily start the chart process pool, after any gunicorn fork.
+
+    Workers come from a forkserver: forking a threaded server mid-request could
+    copy locks held by other threads, and would hand every render process the
+    listening socket. ``composite`` warms the composite backgrounds instead of
+    the per-chart ones.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_render_worker, initargs=(reference_data, composite),
+            )
+        return _render_pool
+
+def _discard_render_pool(pool):
+    # A broken pool refuses new work; drop it so the next get_render_pool starts a fresh one
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            logging.error("Chart process pool broke; starting a new one on the next render")
+            _render_pool = None
+
+def _check_render(pool, future):
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard_render_pool(pool)
+
+def _submit_render(pool, func, *args):
+    try:
+        future = pool.submit(func, *args)
+    except BrokenProcessPool:
+        _discard_render_pool(pool)
+        raise
+    future.add_done_callback(lambda done: _check_render(pool, done))
+    return future
+
+def warm_render_pool(pool, workers):
+    """Start every render process and wait until each has built its backgrounds.
+
+    The pool spawns a process per submit while none is idle, so ``workers``
+    no-op tasks bring all of them up.
+    """
+    futures = [_submit_render(pool, _warm_worker) for _ in range(workers)]
+    return len({future.result() for future in futures})
+
+def shutdown_render_pool():
+    """Stop the chart process pool.
+
+    Interpreter exit normally does this, but uvicorn workers die by re-raising
+    SIGTERM, which skips it.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(cancel_futures=True)
+            _render_pool = None
+
+def chart_points(age, measurements, trajectories=None):
+    """Yield ``(chart key, age, value, trajectory)`` for every chart to render.
+
+    The growth charts highlight this visit; velocity charts, rendered once the
+    child has two visits far enough apart, highlight the latest velocity.
+    """
+    trajectories = trajectories or {}
+    for key, spec in CHART_SPECS.items():
+        # None marks an age outside the chart's reference, drawn as a note instead of a point
+        yield key, age, measurements[spec["measure"]], trajectories.get(spec["measure"])
+    for key, spec in VELOCITY_CHART_SPECS.items():
+        velocities = trajectories.get(spec["measure"])
+        if velocities:
+            yield key, velocities[-1][0], velocities[-1][1], velocities
+
+def submit_chart_renders(pool, sex, age, measurements, trajectories=None):
+    """Submit all charts to the pool; returns {future: chart key}."""
+    return {
+        _submit_render(pool, _render_in_worker, key, sex, point_age, value, trajectory): key
+        for key, point_age, value, trajectory in chart_points(age, measurements, trajectories)
+    }
+
+def submit_composite_render(pool, sex, age, measurements, trajectories=None):
+    """Submit the composite image to the pool; the future yields ``(png bytes, manifest)``."""
+    return _submit_render(pool, _render_composite_in_worker, sex, list(chart_points(age, measurements, trajectories)))
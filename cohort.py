@@ -0,0 +1,223 @@
+"""Offline WHO classification for cohorts of existing measurements.
+
+Streams a CSV or JSONL file of children (``age_months``, ``sex``, ``height``
+in cm, ``weight`` in kg, optional ``bmi`` and ``id``) through the same
+reference tables the web app uses, computing z-scores and percentiles for
+every indicator across a process pool. Results are written as they complete,
+in input order, so memory stays bounded by ``--chunk-size`` x in-flight chunks.
+
+    python cohort.py screening.csv -o classified.csv --workers 8
+    python cohort.py screening.jsonl -o classified.jsonl --charts-dir outliers/
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
+from growth import LMS_TABLES, build_reference_engine, compute_zscore
+from reference import load_reference_data
+
+SEX_KEYS = {
+    "male": "boys", "m": "boys", "boy": "boys", "boys": "boys", "1": "boys",
+    "female": "girls", "f": "girls", "girl": "girls", "girls": "girls", "2": "girls",
+}
+RESULT_COLUMNS = [f"{indicator}_{suffix}" for indicator in LMS_TABLES for suffix in ("z", "percentile")] + ["outlier"]
+
+# Per-process state for cohort workers
+_engine = None
+_chart_options = None
+_templates = None
+
+def _init_worker(chart_options):
+    global _engine, _chart_options, _templates
+    reference_data = load_reference_data()
+    _engine = build_reference_engine(reference_data)
+    _chart_options = chart_options
+    if chart_options["dir"]:
+        from svg_charts import get_svg_templates
+        _templates = get_svg_templates(reference_data)
+
+def _sex_key(row):
+    return SEX_KEYS.get(str(row.get("sex", "")).strip().lower())
+
+def _floats(rows, column):
+    values = np.full(len(rows), np.nan)
+    for index, row in enumerate(rows):
+        try:
+            values[index] = float(row.get(column))
+        except (TypeError, ValueError):
+            pass
+    return values
+
+def _round(value, digits):
+    return None if np.isnan(value) else round(float(value), digits)
+
+def classify_rows(engine, rows, outlier_z):
+    """Add z-score, percentile and outlier columns to a chunk of rows."""
+    ages = _floats(rows, "age_months")
+    heights = _floats(rows, "height")
+    weights = _floats(rows, "weight")
+    bmis = _floats(rows, "bmi")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bmis = np.where(np.isnan(bmis), weights / (heights / 100) ** 2, bmis)
+    sexes = np.array([_sex_key(row) or "" for row in rows])
+    values = {"bmi": bmis, "height": heights, "weight": weights}
+
+    results = {column: np.full(len(rows), np.nan) for column in RESULT_COLUMNS if column != "outlier"}
+    for sex in ("boys", "girls"):
+        mask = sexes == sex
+        if not mask.any():
+            continue
+        for indicator, measured in values.items():
+            z, percentile = compute_zscore(engine, indicator, sex, ages[mask], measured[mask])
+            results[f"{indicator}_z"][mask] = z
+            results[f"{indicator}_percentile"][mask] = percentile
+
+    z_columns = np.column_stack([results[f"{indicator}_z"] for indicator in LMS_TABLES])
+    with np.errstate(invalid="ignore"):
+        outliers = np.nanmax(np.where(np.isnan(z_columns), 0, np.abs(z_columns)), axis=1) > outlier_z
+
+    for index, row in enumerate(rows):
+        row["bmi"] = _round(bmis[index], 2)
+        for indicator in LMS_TABLES:
+            row[f"{indicator}_z"] = _round(results[f"{indicator}_z"][index], 2)
+            row[f"{indicator}_percentile"] = _round(results[f"{indicator}_percentile"][index], 1)
+        row["outlier"] = bool(outliers[index])
+    return rows
+
+def _render_outlier_charts(rows, first_line, chart_options, templates):
+    from charts import CHART_SPECS
+    from svg_charts import render_svg_chart
+
+    for offset, row in enumerate(rows):
+        sex = _sex_key(row)
+        if not row["outlier"] or sex is None:
+            continue
+        try:
+            age_years = float(row["age_months"]) / 12
+        except (TypeError, ValueError):
+            continue
+        row_id = row.get("id") or first_line + offset
+        for key, spec in CHART_SPECS.items():
+            value = row.get(spec["measure"])
+            if value in (None, ""):
+                continue
+            # No z-score means no reference at this age; None draws the range note instead of the point
+            metric = float(value) if row.get(f"{spec['measure']}_z") is not None else None
+            image = render_svg_chart(templates, key, sex, age_years, metric, output=chart_options["format"])
+            if image:
+                path = os.path.join(chart_options["dir"], f"{row_id}_{key}.{chart_options['format']}")
+                with open(path, "wb") as chart_file:
+                    chart_file.write(image)
+
+def _process_chunk(first_line, rows):
+    rows = classify_rows(_engine, rows, _chart_options["outlier_z"])
+    if _chart_options["dir"]:
+        _render_outlier_charts(rows, first_line, _chart_options, _templates)
+    return rows
+
+def read_rows(path):
+    with open(path, newline="") as input_file:
+        if path.endswith(".jsonl") or path.endswith(".ndjson"):
+            for line in input_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(input_file)
+
+def _chunks(rows, size):
+    line = 1
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield line, chunk
+        line += len(chunk)
+
+class _Writer:
+    def __init__(self, path):
+        self._file = open(path, "w", newline="")
+        self._jsonl = path.endswith(".jsonl") or path.endswith(".ndjson")
+        self._csv = None
+
+    def write(self, rows):
+        if self._jsonl:
+            self._file.writelines(json.dumps(row) + "\n" for row in rows)
+            return
+        if self._csv is None and rows:
+            fields = list(rows[0]) + [column for column in RESULT_COLUMNS if column not in rows[0]]
+            self._csv = csv.DictWriter(self._file, fieldnames=fields, extrasaction="ignore")
+            self._csv.writeheader()
+        self._csv.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+def run_cohort(input_path, output_path, workers, chunk_size, outlier_z, charts_dir=None, chart_format="svg"):
+    """Classify ``input_path`` into ``output_path``; returns (rows, outliers, rows with an unrecognized sex).
+
+    Rows whose ``sex`` is not in SEX_KEYS get blank scores; they are counted
+    and the first few values logged, rather than passing as non-outliers.
+    """
+    if charts_dir:
+        os.makedirs(charts_dir, exist_ok=True)
+    chart_options = {"outlier_z": outlier_z, "dir": charts_dir, "format": chart_format}
+    writer = _Writer(output_path)
+    total = outliers = unknown_sex = 0
+    unknown_values = set()
+
+    def collect(rows):
+        nonlocal total, outliers, unknown_sex
+        writer.write(rows)
+        total += len(rows)
+        outliers += sum(1 for row in rows if row["outlier"])
+        for row in rows:
+            if _sex_key(row) is None:
+                unknown_sex += 1
+                if len(unknown_values) < 10:
+                    unknown_values.add(str(row.get("sex", "")))
+
+    # At most two chunks per worker are in flight, bounding memory on huge inputs
+    max_in_flight = max(1, workers) * 2
+    pending = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(chart_options,)) as pool:
+            for first_line, chunk in _chunks(read_rows(input_path), chunk_size):
+                pending.append(pool.submit(_process_chunk, first_line, chunk))
+                while len(pending) >= max_in_flight:
+                    collect(pending.pop(0).result())
+            for future in pending:
+                collect(future.result())
+    finally:
+        writer.close()
+    if unknown_sex:
+        logging.warning(f"{unknown_sex} rows have an unrecognized sex and were not scored "
+                        f"(values: {', '.join(sorted(repr(value) for value in unknown_values))})")
+    return total, outliers, unknown_sex
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute WHO z-scores and percentiles for a cohort file.")
+    parser.add_argument("input", help="CSV or JSONL with age_months, sex, height, weight (optional bmi, id)")
+    parser.add_argument("-o", "--output", required=True, help="CSV or JSONL output path")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--outlier-z", type=float, default=3.0, help="flag rows with any |z| above this")
+    parser.add_argument("--charts-dir", help="render charts for flagged outliers into this directory")
+    parser.add_argument("--chart-format", choices=("svg", "png"), default="svg",
+                        help="png needs the optional cairosvg package")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    total, outliers, unknown_sex = run_cohort(args.input, args.output, args.workers, args.chunk_size,
+                                 args.outlier_z, args.charts_dir, args.chart_format)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Classified {total - unknown_sex} of {total} rows ({outliers} outliers) in {elapsed:.1f}s "
+                 f"-> {args.output}")
+
+if __name__ == "__main__":
+    main()
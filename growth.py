@@ -0,0 +1,175 @@
+import numpy as np
+
+# Reference tables carrying WHO 2007 LMS parameters, by indicator
+LMS_TABLES = {
+    "bmi": "bmifa",
+    "height": "hfa",
+    "weight": "wfa",
+}
+SEXES = ("boys", "girls")
+
+# Mean Gregorian month, as WHO Anthro uses for ages from dates
+DAYS_PER_MONTH = 365.25 / 12
+
+# WHO restricts the LMS tails beyond +/-3 SD for skewed indicators
+RESTRICTED_INDICATORS = {"bmi", "weight"}
+
+def build_reference_engine(reference_data):
+    """Turn the loaded reference tables into month-indexed LMS arrays.
+
+    Each (indicator, sex) entry holds an ``(n, 3)`` float array of L, M, S
+    where row ``i`` is age ``start + i`` months, so a lookup is a subtraction
+    and an index instead of a search.
+    """
+    engine = {}
+    for indicator, prefix in LMS_TABLES.items():
+        for sex in SEXES:
+            table = reference_data.get(f"{prefix}_{sex}_per")
+            if table is None or not {"Age (months)", "L", "M", "S"}.issubset(table):
+                continue
+            months = np.asarray(table["Age (months)"]).astype(np.intp)
+            start = int(months.min())
+            lms = np.full((int(months.max()) - start + 1, 3), np.nan)
+            lms[months - start] = np.column_stack([table["L"], table["M"], table["S"]])
+            engine[(indicator, sex)] = {"start": start, "lms": lms}
+    return engine
+
+def reference_range(engine, indicator, sex):
+    """First and last month the (indicator, sex) table covers, or None without a table."""
+    table = engine.get((indicator, sex))
+    if table is None:
+        return None
+    return table["start"], table["start"] + len(table["lms"]) - 1
+
+def out_of_range_indicators(engine, sex, age_months):
+    """Indicators with no WHO reference at ``age_months`` (e.g. weight-for-age past 120 months)."""
+    missing = []
+    for indicator in LMS_TABLES:
+        months = reference_range(engine, indicator, sex)
+        if months is None or not months[0] <= age_months <= months[1]:
+            missing.append(indicator)
+    return missing
+
+def age_in_months(birth_date, measured_on):
+    """Exact age in fractional months between two dates."""
+    return (measured_on - birth_date).days / DAYS_PER_MONTH
+
+def _interpolate_lms(table, age_months):
+    lms = table["lms"]
+    last = len(lms) - 1
+    pos = np.asarray(age_months, dtype=float) - table["start"]
+    in_range = (pos >= 0) & (pos <= last)
+    pos = np.where(in_range, pos, 0.0)
+    lo = np.floor(pos).astype(np.intp)
+    hi = np.minimum(lo + 1, last)
+    frac = (pos - lo)[..., None]
+    params = lms[lo] + (lms[hi] - lms[lo]) * frac
+    params[~in_range] = np.nan
+    return params[..., 0], params[..., 1], params[..., 2]
+
+def _lms_value(L, M, S, z):
+    # Measurement sitting at z SD for the given LMS parameters
+    return M * np.power(1 + L * S * z, 1 / L)
+
+def lms_zscore(value, L, M, S, restricted=False):
+    value = np.asarray(value, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (np.power(value / M, L) - 1) / (L * S)
+        if restricted:
+            sd3 = _lms_value(L, M, S, 3)
+            sd2 = _lms_value(L, M, S, 2)
+            z = np.where(z > 3, 3 + (value - sd3) / (sd3 - sd2), z)
+            sd_neg3 = _lms_value(L, M, S, -3)
+            sd_neg2 = _lms_value(L, M, S, -2)
+            z = np.where(z < -3, -3 + (value - sd_neg3) / (sd_neg2 - sd_neg3), z)
+    return z
+
+def _erf(x):
+    # Abramowitz & Stegun 7.1.26, absolute error below 1.5e-7
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return sign * (1.0 - poly * np.exp(-x * x))
+
+def zscore_to_percentile(z):
+    return 50.0 * (1.0 + _erf(np.asarray(z, dtype=float) / np.sqrt(2.0)))
+
+def _as_result(array, scalar):
+    return float(array) if scalar else array
+
+def compute_zscore(engine, indicator, sex, age_months, value):
+    """Return ``(z, percentile)`` for one child or an array of children.
+
+    Ages are in (possibly fractional) months and are linearly interpolated
+    between table rows. Ages outside the table or unknown (indicator, sex)
+    pairs yield NaN.
+    """
+    scalar = np.ndim(age_months) == 0 and np.ndim(value) == 0
+    table = engine.get((indicator, sex))
+    if table is None:
+        shape = np.broadcast(np.asarray(age_months), np.asarray(value)).shape
+        z = np.full(shape, np.nan)
+    else:
+        L, M, S = _interpolate_lms(table, age_months)
+        z = lms_zscore(value, L, M, S, restricted=indicator in RESTRICTED_INDICATORS)
+    return _as_result(z, scalar), _as_result(zscore_to_percentile(z), scalar)
+
+def growth_metrics(engine, sex, age_months, height, weight, bmi):
+    measurements = {"bmi": bmi, "height": height, "weight": weight}
+    metrics = {}
+    for indicator, value in measurements.items():
+        z, percentile = compute_zscore(engine, indicator, sex, age_months, value)
+        metrics[f"{indicator}_z"] = None if np.isnan(z) else round(z, 2)
+        metrics[f"{indicator}_percentile"] = None if np.isnan(percentile) else round(percentile, 1)
+    return metrics
+
+# Indicators with velocity charts, and the derived tables holding their reference velocity
+VELOCITY_TABLES = {
+    "height": "hvel",
+    "weight": "wvel",
+}
+
+def velocity_reference_tables(reference_data):
+    """Annual growth velocity of the WHO median, as chart tables.
+
+    The velocity at month ``t`` is ``M(t + 6) - M(t - 6)``, the median gain over
+    the surrounding year, so the first and last six months are NaN.
+    """
+    tables = {}
+    for indicator, velocity_prefix in VELOCITY_TABLES.items():
+        for sex in SEXES:
+            table = reference_data.get(f"{LMS_TABLES[indicator]}_{sex}_per")
+            if table is None or not {"Age (months)", "M"}.issubset(table):
+                continue
+            median = np.asarray(table["M"], dtype=float)
+            velocity = np.full(len(median), np.nan)
+            velocity[6:-6] = median[12:] - median[:-12]
+            tables[f"{velocity_prefix}_{sex}_per"] = {
+                "Age (years)": np.asarray(table["Age (months)"], dtype=float) / 12,
+                "Median Velocity": velocity,
+            }
+    return tables
+
+def growth_velocity(points, min_days=60):
+    """Annualized change between visits at least ``min_days`` apart.
+
+    ``points`` are ``(age in years, value, measurement date)`` sorted by date;
+    returns ``(midpoint age, change per year)`` pairs. The interval comes from
+    the dates, since ages without a birth date are only known to the year.
+    """
+    velocities = []
+    anchor = None
+    for age, value, measured_on in points:
+        if value is None:
+            continue
+        if anchor is None:
+            anchor = (age, value, measured_on)
+            continue
+        # WHO's shortest velocity increment is two months; closer visits are mostly measurement noise
+        days = (measured_on - anchor[2]).days
+        if days >= min_days:
+            years = days / (DAYS_PER_MONTH * 12)
+            velocities.append(((anchor[0] + age) / 2, (value - anchor[1]) / years))
+            anchor = (age, value, measured_on)
+    return velocities
@@ -0,0 +1,26 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+Points prometheus_client at a shared directory before any worker imports the
+app, so ``/metrics`` aggregates samples from every worker process, and builds
+each worker's chart backgrounds before it takes requests.
+"""
+import glob
+import os
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be merged into this one
+    multiproc_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        os.remove(path)
+
+def post_worker_init(worker):
+    # Runs in the worker once the app is imported (app:app and asgi:application alike)
+    import app
+    app.warm_charts()
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
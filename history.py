@@ -0,0 +1,73 @@
+"""Per-child measurement history.
+
+Every processed report appends a visit for its child to an SQLite table
+indexed on ``(child, age_years)``, so one child's history is a single index
+range scan however many visits the store holds. Re-processing the same report
+is a no-op: visits are unique per child and report digest.
+
+Each visit keeps its measurement date, which velocities are computed from;
+visits recorded before the column existed fall back to their recording date.
+"""
+import logging
+import sqlite3
+import time
+from datetime import date
+from growth import VELOCITY_TABLES, growth_velocity
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS visits (id INTEGER PRIMARY KEY, child TEXT NOT NULL, digest TEXT NOT NULL, "
+    "name TEXT, sex TEXT, age_years REAL NOT NULL, height REAL, weight REAL, bmi REAL, "
+    "recorded_at REAL NOT NULL, measured_on TEXT, UNIQUE (child, digest))",
+    "CREATE INDEX IF NOT EXISTS visits_child_age ON visits (child, age_years, id)",
+)
+MEASURES = ("bmi", "height", "weight")
+
+def child_key(name, sex, rpa_id, key_by="name"):
+    """Identify a child across visits, by normalized name and sex or by RPA item."""
+    if key_by == "rpa_id":
+        return f"rpa:{rpa_id}"
+    return f"name:{' '.join(str(name).split()).casefold()}|{sex}"
+
+class MeasurementStore:
+    def __init__(self, path):
+        self.db = SQLiteDatabase(path, SCHEMA)
+        self.db.ensure_column("visits", "measured_on", "TEXT")
+
+    def add_visit(self, child, digest, name, sex, age_years, measured_on, measurements):
+        try:
+            self.db.execute(
+                "INSERT OR IGNORE INTO visits (child, digest, name, sex, age_years, height, weight, bmi, recorded_at, "
+                "measured_on) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (child, digest, name, sex, age_years, measurements.get("height"), measurements.get("weight"),
+                 measurements.get("bmi"), time.time(), measured_on.isoformat()),
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Error recording visit: {e}")
+
+    def visits(self, child):
+        """The child's visits as dicts, oldest measurement first."""
+        try:
+            rows = self.db.execute(
+                "SELECT age_years, height, weight, bmi, COALESCE(measured_on, date(recorded_at, 'unixepoch')) "
+                "FROM visits WHERE child = ?", (child,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading visit history: {e}")
+            return []
+        visits = [{"age": row[0], "height": row[1], "weight": row[2], "bmi": row[3],
+                   "measured_on": date.fromisoformat(row[4])} for row in rows]
+        return sorted(visits, key=lambda visit: (visit["measured_on"], visit["age"]))
+
+def trajectories(visits):
+    """Chart series for a visit history, keyed by chart measure.
+
+    Growth measures map to ``(age, value)`` per visit; ``<indicator>_velocity``
+    maps to ``(midpoint age, change per year)`` between visits.
+    """
+    series = {measure: [(visit["age"], visit[measure]) for visit in visits if visit[measure] is not None]
+              for measure in MEASURES}
+    for indicator in VELOCITY_TABLES:
+        series[f"{indicator}_velocity"] = growth_velocity(
+            [(visit["age"], visit[indicator], visit["measured_on"]) for visit in visits])
+    return series
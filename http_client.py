@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import metrics
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', 0.5))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))
+
+_sessions = {}
+_session_pid = None
+_session_lock = threading.Lock()
+
+class CountingRetry(Retry):
+    def increment(self, *args, **kwargs):
+        metrics.RETRIES.labels("http").inc()
+        return super().increment(*args, **kwargs)
+
+def _build_session(idempotent):
+    # Bitrix field updates are idempotent, so their POSTs are retried alongside GETs;
+    # exhausted retries hand back the last response for the caller to inspect
+    retry = CountingRetry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"} if idempotent else {"GET"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session(idempotent=True):
+    """Shared keep-alive session, rebuilt in each forked worker process.
+
+    With ``idempotent=False`` a POST that may have reached the server is never
+    resent; only failed connects are retried.
+    """
+    global _session_pid
+    with _session_lock:
+        if _session_pid != os.getpid():
+            _sessions.clear()
+            _session_pid = os.getpid()
+        if idempotent not in _sessions:
+            _sessions[idempotent] = _build_session(idempotent)
+        return _sessions[idempotent]
+
+def request(method, url, service="other", idempotent=True, **kwargs):
+    """Send through the shared session; ``service`` labels the call's metrics.
+
+    Pass ``idempotent=False`` for POSTs that must not be replayed, such as
+    exchanging a single-use OAuth code or refresh token.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    start = time.perf_counter()
+    try:
+        response = get_session(idempotent).request(method, url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        metrics.observe_outbound(service, time.perf_counter() - start, error=e)
+        raise
+    metrics.observe_outbound(service, time.perf_counter() - start, status=response.status_code)
+    return response
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, dedupe_key TEXT NOT NULL, status TEXT NOT NULL, "
+    "owner INTEGER NOT NULL, owner_token TEXT, submitted_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+    "result TEXT, error TEXT)",
+    # At most one unfinished job per dedupe key, across every worker
+    "CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (dedupe_key) WHERE finished_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)",
+)
+JOB_COLUMNS = ("id", "status", "submitted_at", "started_at", "finished_at", "result", "error")
+
+class QueueFull(Exception):
+    pass
+
+def _read_boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as boot_id:
+            return boot_id.read().strip()
+    except OSError:
+        return ""
+
+_BOOT_ID = _read_boot_id()
+
+def _process_token(pid):
+    """Boot ID and start time of process ``pid``, or None if it is gone or /proc is unavailable.
+
+    Unlike the PID, the token changes when a restarted worker reuses the PID.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # Fields after the parenthesized command name are fixed; start time is field 22
+    return f"{_BOOT_ID}:{stat.rsplit(')', 1)[1].split()[19]}"
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _owner_alive(pid, token):
+    if token is None:
+        # Recorded where /proc is unavailable
+        return _process_alive(pid)
+    return _process_token(pid) == token
+
+class JobQueue:
+    """Job queue with in-flight dedupe and bounded backlog, shared by every worker.
+
+    Jobs and their dedupe keys live in SQLite, so any gunicorn worker can
+    answer for a job and a key submitted to one worker collapses onto the job
+    another worker is running. Each job runs on the thread pool of the worker
+    that accepted it; jobs left unfinished by a worker that exited are marked
+    failed. Workers are recognized by PID and process start time, so a restarted
+    worker that reuses a PID does not keep its predecessor's jobs running. Finished jobs stay queryable for ``result_ttl`` seconds.
+    """
+
+    def __init__(self, path, workers, max_pending, result_ttl):
+        self.db = SQLiteDatabase(path, SCHEMA)
+        self.db.ensure_column("jobs", "owner_token", "TEXT")
+        self._workers = workers
+        self._max_pending = max_pending
+        self._result_ttl = result_ttl
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first submit so worker threads never cross a fork
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="webhook-job")
+            return self._executor
+
+    def _fail_orphaned(self, now):
+        owners = self.db.execute("SELECT DISTINCT owner, owner_token FROM jobs WHERE finished_at IS NULL").fetchall()
+        for owner, token in owners:
+            if not _owner_alive(owner, token):
+                self.db.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Worker exited before the job finished', "
+                    "finished_at = ? WHERE owner = ? AND owner_token IS ? AND finished_at IS NULL", (now, owner, token),
+                )
+
+    def _row(self, job_id):
+        row = self.db.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def submit(self, key, func, *args):
+        """Enqueue ``func(*args)``; returns ``(job, created)``.
+
+        Raises QueueFull when ``max_pending`` jobs are already in flight.
+        """
+        dedupe_key = json.dumps(key, default=str)
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("DELETE FROM jobs WHERE finished_at < ?", (now - self._result_ttl,))
+            self._fail_orphaned(now)
+            row = self.db.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND finished_at IS NULL", (dedupe_key,)
+            ).fetchone()
+            if row is not None:
+                self.db.execute("COMMIT")
+                return self._row(row[0]), False
+            pending = self.db.execute("SELECT COUNT(*) FROM jobs WHERE finished_at IS NULL").fetchone()[0]
+            if pending >= self._max_pending:
+                raise QueueFull(f"{pending} jobs already pending")
+            job_id = uuid.uuid4().hex
+            self.db.execute(
+                "INSERT INTO jobs (id, dedupe_key, status, owner, owner_token, submitted_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, dedupe_key, os.getpid(), _process_token(os.getpid()), now),
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        job = self._row(job_id)
+        self._get_executor().submit(self._run, job_id, func, args)
+        return job, True
+
+    def _update(self, job_id, **fields):
+        try:
+            self.db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+                            (*fields.values(), job_id))
+        except sqlite3.Error as e:
+            logging.error(f"Error recording job {job_id}: {e}")
+
+    def _run(self, job_id, func, args):
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            result = func(*args)
+            status, error = "succeeded", None
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            result, status, error = None, "failed", str(e)
+        result = json.dumps(result, default=str) if result is not None else None
+        self._update(job_id, status=status, result=result, error=error, finished_at=time.time())
+
+    def get(self, job_id):
+        return self._row(job_id)
+
+    def pending(self):
+        return self.db.execute("SELECT COUNT(*) FROM jobs WHERE finished_at IS NULL").fetchone()[0]
@@ -0,0 +1,83 @@
+"""Prometheus metrics for the pipeline.
+
+Under gunicorn every worker writes its samples to ``PROMETHEUS_MULTIPROC_DIR``
+(set up by ``gunicorn.conf.py``) and ``/metrics`` merges them, so a scrape sees
+the whole server no matter which worker answers it. Without that variable the
+metrics live in this process only, which is what ``python app.py`` wants.
+"""
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Pipeline stages run from well under a millisecond (z-scores) to tens of seconds (slow report sites)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUESTS = Counter(
+    "app_requests_total", "HTTP requests handled, by endpoint and status code",
+    ["endpoint", "method", "status"],
+)
+REQUEST_SECONDS = Histogram(
+    "app_request_duration_seconds", "Time to handle an HTTP request",
+    ["endpoint"], buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds", "Time spent in each pipeline stage",
+    ["stage"], buckets=LATENCY_BUCKETS,
+)
+STAGE_FAILURES = Counter(
+    "pipeline_stage_failures_total", "Pipeline stages that raised or returned no result",
+    ["stage"],
+)
+OUTBOUND_SECONDS = Histogram(
+    "outbound_request_duration_seconds", "Outbound HTTP calls, including urllib3 retries",
+    ["service"], buckets=LATENCY_BUCKETS,
+)
+OUTBOUND_FAILURES = Counter(
+    "outbound_request_failures_total", "Outbound HTTP calls that errored or returned 4xx/5xx",
+    ["service"],
+)
+RETRIES = Counter(
+    "outbound_retries_total", "Retried outbound calls (HTTP retries and GCS upload attempts)",
+    ["service"],
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    "result_cache_lookups_total", "Reports served from the result cache (hit) or built (miss)",
+    ["result"],
+)
+BITRIX_UPDATES_SKIPPED = Counter(
+    "bitrix_updates_skipped_total", "RPA updates skipped because the item already had the same values",
+)
+UPLOADED_BYTES = Counter(
+    "gcs_uploaded_bytes_total", "Chart bytes uploaded to Google Cloud Storage",
+)
+
+@contextmanager
+def span(stage):
+    """Time a pipeline stage; exceptions count as a failure of that stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def record_failure(stage):
+    STAGE_FAILURES.labels(stage).inc()
+
+def observe_outbound(service, seconds, status=None, error=None):
+    OUTBOUND_SECONDS.labels(service).observe(seconds)
+    if error is not None or (status is not None and status >= 400):
+        OUTBOUND_FAILURES.labels(service).inc()
+
+def render_latest():
+    """Return ``(body, content_type)`` for the /metrics endpoint."""
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,78 @@
+"""Opt-in sampling profiler for slow requests.
+
+With ``PROFILE_SLOW_REQUESTS`` set to a number of seconds, each request's
+thread is sampled every ``PROFILE_INTERVAL`` seconds from a background thread.
+Requests slower than the threshold log their hottest stacks and, when
+``PROFILE_DIR`` is set, write them in folded format (one ``frame;frame;frame
+count`` line per stack) for flamegraph.pl or speedscope. Faster requests throw
+their samples away.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_SLOW_REQUESTS = float(os.getenv('PROFILE_SLOW_REQUESTS', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+PROFILE_TOP_STACKS = 5
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+class StackSampler:
+    """Samples one thread's stack until stopped; ``stacks`` counts folded stacks."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self.stacks = Counter()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+
+def start_request_profile():
+    if PROFILE_SLOW_REQUESTS <= 0:
+        return None
+    return StackSampler(threading.get_ident()).start(), time.perf_counter()
+
+def finish_request_profile(profile, endpoint):
+    if profile is None:
+        return
+    sampler, start = profile
+    stacks = sampler.stop()
+    elapsed = time.perf_counter() - start
+    if elapsed < PROFILE_SLOW_REQUESTS or not stacks:
+        return
+
+    total = sum(stacks.values())
+    top = "\n".join(f"  {count / total:6.1%}  {' > '.join(stack.split(';')[-3:])}"
+                    for stack, count in stacks.most_common(PROFILE_TOP_STACKS))
+    logging.warning(f"Slow request {endpoint} took {elapsed:.2f}s ({total} samples); hottest stacks:\n{top}")
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{endpoint}-{int(time.time() * 1000)}-{os.getpid()}.folded")
+        with open(path, "w") as profile_file:
+            profile_file.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+        logging.warning(f"Profile written to {path}")
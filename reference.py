@@ -0,0 +1,179 @@
+"""WHO reference tables, compiled into a memory-mappable artifact.
+
+``python reference.py`` compiles ``csv_files/`` into ``reference.npy`` (every
+column of every table laid out contiguously as float64) and a small JSON index.
+Workers ``np.load`` it with ``mmap_mode="r"`` so the pages are shared through
+the OS page cache instead of each process parsing the CSVs. A missing artifact
+falls back to parsing the CSVs directly.
+
+The index stores a hash of the source CSVs. Workers do not re-hash them on
+boot; ``python reference.py --check`` exits non-zero when the artifact is out
+of date with ``csv_files/``.
+"""
+import argparse
+import csv
+import sys
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_DIR = os.path.join(BASE_DIR, "csv_files")
+ARTIFACT_PATH = os.getenv('REFERENCE_ARTIFACT', os.path.join(CSV_DIR, "reference.npy"))
+
+CSV_FILES = {
+    "bmifa_boys_per": "bmifa-boys-5-19years-per.csv",
+    "bmifa_boys_z": "bmifa-boys-5-19years-z.csv",
+    "bmifa_girls_per": "bmifa-girls-5-19years-per.csv",
+    "bmifa_girls_z": "bmifa-girls-5-19years-z.csv",
+    "hfa_boys_per": "hfa-boys-5-19years-per.csv",
+    "hfa_boys_z": "sft-hfa-boys-perc-5-19years.csv",
+    "hfa_girls_per": "hfa-girls-5-19years-per.csv",
+    "hfa_girls_z": "sft-hfa-girls-perc-5-19years.csv",
+    "wfa_boys_per": "wfa-boys-5-10years-per.csv",
+    "wfa_boys_z": "wfa-boys-5-10years-z.csv",
+    "wfa_girls_per": "wfa-girls-5-10years-per.csv",
+    "wfa_girls_z": "wfa-girls-5-10years-z.csv",
+}
+
+COLUMN_MAPPING = {
+    "Year: Month": "Age (years)",
+    "Month": "Age (months)",
+    "3rd": "3rd Percentile",
+    "15th": "15th Percentile",
+    "50th": "50th Percentile",
+    "85th": "85th Percentile",
+    "97th": "97th Percentile",
+    "-3 SD": "-3SD Z-Scores",
+    "-2 SD": "-2SD Z-Scores",
+    "-1 SD": "-1SD Z-Scores",
+    "Median": "Median Z-Scores",
+    "1 SD": "1SD Z-Scores",
+    "2 SD": "2SD Z-Scores",
+    "3 SD": "3SD Z-Scores",
+    "3rdd": "3rd Z-Scores",
+    "15thh": "15th Z-Scores",
+    "Mediann": "Median Z Scores",
+    "85thh": "85th Z-Scores",
+    "97thh": "97th Z-Scores",
+}
+
+def parse_age(year_month):
+    try:
+        years, months = map(int, year_month.split(":"))
+        return years + (months / 12)
+    except ValueError:
+        return None
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+def read_reference_csv(path):
+    """Parse one WHO CSV into ``{normalized column: float array}``."""
+    with open(path, newline="") as csv_file:
+        reader = csv.reader(csv_file)
+        header = [COLUMN_MAPPING.get(name, name) for name in next(reader)]
+        rows = [row for row in reader if row]
+    table = {}
+    for index, column in enumerate(header):
+        values = [row[index] for row in rows]
+        if column == "Age (years)":
+            ages = [parse_age(value) for value in values]
+            table[column] = np.array([np.nan if age is None else age for age in ages])
+        else:
+            table[column] = np.array([_to_float(value) for value in values])
+    return table
+
+def _source_hash(csv_dir):
+    digest = hashlib.sha256()
+    for key, filename in sorted(CSV_FILES.items()):
+        digest.update(key.encode())
+        with open(os.path.join(csv_dir, filename), "rb") as csv_file:
+            digest.update(csv_file.read())
+    return digest.hexdigest()
+
+def _index_path(artifact_path):
+    return os.path.splitext(artifact_path)[0] + ".json"
+
+def load_csv_tables(csv_dir=CSV_DIR):
+    data = {}
+    for key, filename in CSV_FILES.items():
+        file_path = os.path.join(csv_dir, filename)
+        try:
+            data[key] = read_reference_csv(file_path)
+        except Exception as e:
+            logging.error(f"Error loading {file_path}: {e}")
+    return data
+
+def compile_reference(csv_dir=CSV_DIR, artifact_path=ARTIFACT_PATH):
+    tables = load_csv_tables(csv_dir)
+    index = {"source_hash": _source_hash(csv_dir), "tables": {}}
+    blocks = []
+    offset = 0
+    for key, table in tables.items():
+        columns = list(table)
+        rows = len(table[columns[0]]) if columns else 0
+        index["tables"][key] = {"offset": offset, "rows": rows, "columns": columns}
+        blocks.extend(table[column] for column in columns)
+        offset += rows * len(columns)
+    values = np.concatenate(blocks) if blocks else np.empty(0)
+    np.save(artifact_path, values.astype(np.float64))
+    with open(_index_path(artifact_path), "w") as index_file:
+        json.dump(index, index_file, indent=1)
+    return index
+
+def artifact_is_current(artifact_path=ARTIFACT_PATH, csv_dir=CSV_DIR):
+    """True if the artifact was compiled from the CSVs currently in ``csv_dir``."""
+    try:
+        with open(_index_path(artifact_path)) as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return False
+    return index.get("source_hash") == _source_hash(csv_dir)
+
+def load_artifact(artifact_path=ARTIFACT_PATH):
+    """Map the compiled artifact; returns None if it is missing.
+
+    Staleness is not checked here, since that means reading every CSV the
+    artifact exists to skip; see ``artifact_is_current``.
+    """
+    try:
+        with open(_index_path(artifact_path)) as index_file:
+            index = json.load(index_file)
+        values = np.load(artifact_path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        logging.warning(f"Reference artifact unavailable ({e}); parsing CSVs")
+        return None
+
+    data = {}
+    for key, entry in index["tables"].items():
+        offset, rows = entry["offset"], entry["rows"]
+        data[key] = {
+            column: values[offset + position * rows:offset + (position + 1) * rows]
+            for position, column in enumerate(entry["columns"])
+        }
+    return data
+
+def load_reference_data(artifact_path=ARTIFACT_PATH, csv_dir=CSV_DIR):
+    data = load_artifact(artifact_path)
+    return data if data is not None else load_csv_tables(csv_dir)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compile csv_files/ into the reference artifact.")
+    parser.add_argument("--check", action="store_true",
+                        help="only check that the artifact matches the CSVs; exits 1 if it does not")
+    args = parser.parse_args()
+    if args.check:
+        if not artifact_is_current():
+            logging.error(f"{ARTIFACT_PATH} is out of date with {CSV_DIR}; run `python reference.py`")
+            sys.exit(1)
+        logging.info(f"{ARTIFACT_PATH} is up to date")
+    else:
+        compiled = compile_reference()
+        logging.info(f"Compiled {len(compiled['tables'])} reference tables into {ARTIFACT_PATH}")
@@ -0,0 +1,181 @@
+import logging
+from html.parser import HTMLParser
+
+try:
+    import lxml.html
+except ImportError:  # lxml is optional; fall back to the streaming html.parser pass
+    lxml = None
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# field -> (tag, class, position among matches, default, read nested <span>)
+# A class containing spaces must match the attribute exactly, a single class
+# only needs to be present, mirroring BeautifulSoup's find_all semantics.
+RESEARCH_STYLE = "width:55%; text-align: right;"
+FIELD_SELECTORS = {
+    "name": ("span", "name abs", 0, "Unknown", False),
+    "age": ("span", "old abs", 0, "0", False),
+    "gender": ("span", "sex abs", 0, "Unknown", False),
+    "height": ("span", "height abs", 0, "0 cm", False),
+    "measured_at": ("span", "date abs", 0, "", False),
+    # Unverified: no report seen so far carries a birth date, and this class is a
+    # guess following the other "<field> abs" spans. Without it the age is approximate.
+    "birth_date": ("span", "birth abs", 0, "", False),
+    "weight": ("div", "data-text font-size-nom bold", 0, "0", False),
+    "smm": ("div", "data-text font-size-nom bold", 1, "0", False),
+    "bmi": ("div", "data-text font-size-nom bold", 3, "0", False),
+    "pbf": ("div", "data-text font-size-nom bold", 4, "0", False),
+    "score": ("div", "box", 0, "0", False),
+    "ecf": ("div", "bold", 1, "0", False),
+    "cf": ("div", "bold", 2, "0", False),
+    "protein": ("div", "bold", 3, "0", False),
+    "minerals": ("div", "bold", 4, "0", False),
+    "fat": ("div", "bold", 5, "0", False),
+    "body_water": ("div", "bold", 6, "0", False),
+    "soft_lean_mass": ("div", "bold", 7, "0", False),
+    "fat_free_mass": ("div", "bold", 8, "0", False),
+    "body_fat_mass": ("div", "data-text font-size-nom bold", 2, "0", False),
+    "basal_metabolic_rate": ("div", "td t-center", 0, "0", True),
+    "bone_mineral": ("div", "td t-center", 1, "0", True),
+    "waist_hip_ratio": ("div", "td t-center", 2, "0", True),
+    "visceral_fat_level": ("div", "td t-center", 3, "0", True),
+}
+# Extra attributes a selector must match exactly
+SELECTOR_ATTRS = {
+    ("div", "td t-center"): {"style": RESEARCH_STYLE},
+}
+
+def _build_index():
+    selectors = {}
+    for tag, cls, position, default, nested in FIELD_SELECTORS.values():
+        selectors.setdefault(tag, set()).add(cls)
+    # How many matches of each selector are needed before we can stop looking
+    needed = {}
+    for tag, cls, position, default, nested in FIELD_SELECTORS.values():
+        needed[(tag, cls)] = max(needed.get((tag, cls), 0), position + 1)
+    return selectors, needed
+
+_SELECTORS, _NEEDED = _build_index()
+
+def _matches(cls, class_attr, class_list):
+    return class_attr == cls if " " in cls else cls in class_list
+
+def _collect(elements, get_attr):
+    """One walk over every span/div, bucketing elements per selector."""
+    matches = {key: [] for key in _NEEDED}
+    remaining = len(_NEEDED)
+    for tag, element in elements:
+        classes = _SELECTORS.get(tag)
+        if not classes:
+            continue
+        class_attr = get_attr(element, "class")
+        if not class_attr:
+            continue
+        class_list = class_attr.split()
+        for cls in classes:
+            key = (tag, cls)
+            bucket = matches[key]
+            if len(bucket) >= _NEEDED[key] or not _matches(cls, class_attr, class_list):
+                continue
+            extra = SELECTOR_ATTRS.get(key)
+            if extra and any(get_attr(element, name) != value for name, value in extra.items()):
+                continue
+            bucket.append(element)
+            if len(bucket) == _NEEDED[key]:
+                remaining -= 1
+        if remaining == 0:
+            break
+    return matches
+
+def _extract(matches, text_of, nested_span):
+    data = {}
+    for field, (tag, cls, position, default, nested) in FIELD_SELECTORS.items():
+        bucket = matches[(tag, cls)]
+        element = bucket[position] if position < len(bucket) else None
+        if element is not None and nested:
+            element = nested_span(element)
+        data[field] = text_of(element).strip() if element is not None else default
+    return data
+
+def _parse_lxml(content):
+    root = lxml.html.fromstring(content)
+    elements = ((element.tag, element) for element in root.iter("span", "div"))
+    matches = _collect(elements, lambda element, name: element.get(name))
+    return _extract(matches, lambda element: element.text_content(), lambda element: element.find(".//span"))
+
+class _StreamingCollector(HTMLParser):
+    """Tree-free pass that only keeps text for elements a selector matched."""
+
+    def __init__(self):
+        super().__init__()
+        self.matches = {key: [] for key in _NEEDED}
+        self._open = []
+        self._capturing = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        records = []
+        if tag == "span":
+            for record in self._capturing:
+                if record["nested"] and record["span"] is None:
+                    record["span"] = {"text": [], "nested": False, "span": None}
+                    records.append(record["span"])
+        classes = _SELECTORS.get(tag)
+        attrs = dict(attrs)
+        class_attr = attrs.get("class")
+        if classes and class_attr:
+            class_list = class_attr.split()
+            for cls in classes:
+                key = (tag, cls)
+                bucket = self.matches[key]
+                if len(bucket) >= _NEEDED[key] or not _matches(cls, class_attr, class_list):
+                    continue
+                extra = SELECTOR_ATTRS.get(key)
+                if extra and any(attrs.get(name) != value for name, value in extra.items()):
+                    continue
+                record = {"text": [], "nested": tag == "div" and cls == "td t-center", "span": None}
+                bucket.append(record)
+                records.append(record)
+        self._open.append((tag, records))
+        self._capturing.extend(records)
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        # Close back to the matching open tag, tolerating unclosed children
+        for depth in range(len(self._open) - 1, -1, -1):
+            if self._open[depth][0] == tag:
+                for _, records in self._open[depth:]:
+                    for record in records:
+                        self._capturing.remove(record)
+                del self._open[depth:]
+                return
+
+    def handle_data(self, data):
+        for record in self._capturing:
+            record["text"].append(data)
+
+def _parse_stream(content):
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    collector = _StreamingCollector()
+    collector.feed(content)
+    collector.close()
+    return _extract(collector.matches, lambda record: "".join(record["text"]), lambda record: record["span"])
+
+def parse_report(content, backend=None):
+    """Extract every report field from the page in a single traversal.
+
+    ``backend`` is ``"lxml"`` (a C parser, used by default when installed) or
+    ``"stream"`` (the standard library tokenizer without building a tree).
+    """
+    if backend is None:
+        backend = "lxml" if lxml is not None else "stream"
+    if backend == "lxml":
+        try:
+            return _parse_lxml(content)
+        except Exception as e:
+            logging.warning(f"lxml could not parse report, retrying with the streaming parser: {e}")
+    return _parse_stream(content)
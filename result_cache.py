@@ -0,0 +1,132 @@
+"""Persistent cache of finished reports.
+
+Bitrix automations fire ``/webhook`` for the same report on every stage
+change, so each report's result (Bitrix fields, WHO metrics and chart URLs) is
+kept in SQLite under two keys:
+
+* the normalized report URL, so a repeat webhook within ``ttl`` skips the
+  scrape entirely;
+* a hash of the extracted measurements, so a report that is scraped again but
+  has not changed reuses the rendered and uploaded charts.
+
+Entries expire after ``ttl`` seconds and the least recently used are dropped
+past ``max_entries``. The last update sent to each RPA item is remembered as a
+hash so identical updates can be skipped.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS results (url TEXT PRIMARY KEY, digest TEXT NOT NULL, report TEXT NOT NULL, "
+    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS results_digest ON results (digest, created_at)",
+    "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)",
+    "CREATE TABLE IF NOT EXISTS rpa_updates (rpa_id TEXT PRIMARY KEY, digest TEXT NOT NULL, sent_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS rpa_updates_sent ON rpa_updates (sent_at)",
+)
+
+def content_digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+class ResultCache:
+    def __init__(self, path, ttl, max_entries):
+        self.db = SQLiteDatabase(path, SCHEMA)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _fresh_after(self):
+        return time.time() - self.ttl
+
+    def _load(self, url, report):
+        try:
+            self.db.execute("UPDATE results SET accessed_at = ? WHERE url = ?", (time.time(), url))
+        except sqlite3.Error as e:
+            logging.warning(f"Could not touch cached result: {e}")
+        return json.loads(report)
+
+    def get_by_url(self, url):
+        """Return ``(digest, report)`` stored for ``url``, or ``(None, None)``."""
+        if not self.enabled:
+            return None, None
+        try:
+            row = self.db.execute(
+                "SELECT url, report, digest FROM results WHERE url = ? AND created_at > ?", (url, self._fresh_after())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading result cache: {e}")
+            return None, None
+        if row is None:
+            return None, None
+        return row[2], self._load(row[0], row[1])
+
+    def get_by_digest(self, digest):
+        if not self.enabled:
+            return None
+        try:
+            row = self.db.execute(
+                "SELECT url, report FROM results WHERE digest = ? AND created_at > ? ORDER BY created_at DESC LIMIT 1",
+                (digest, self._fresh_after()),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading result cache: {e}")
+            return None
+        return None if row is None else self._load(row[0], row[1])
+
+    def put(self, url, digest, report):
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            self.db.execute(
+                "INSERT INTO results (url, digest, report, created_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET digest = excluded.digest, report = excluded.report, "
+                "created_at = excluded.created_at, accessed_at = excluded.accessed_at",
+                (url, digest, json.dumps(report), now, now),
+            )
+            self._evict(now)
+        except sqlite3.Error as e:
+            logging.error(f"Error writing result cache: {e}")
+
+    def _evict(self, now):
+        cutoff = now - self.ttl
+        self.db.execute("DELETE FROM results WHERE created_at <= ?", (cutoff,))
+        self.db.execute("DELETE FROM rpa_updates WHERE sent_at <= ?", (cutoff,))
+        # Least recently used entries beyond the size bound
+        self.db.execute(
+            "DELETE FROM results WHERE accessed_at <= ("
+            "SELECT accessed_at FROM results ORDER BY accessed_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def update_unchanged(self, rpa_id, query_params):
+        """True if ``query_params`` were already sent to ``rpa_id`` within the TTL."""
+        if not self.enabled:
+            return False
+        try:
+            row = self.db.execute(
+                "SELECT digest FROM rpa_updates WHERE rpa_id = ? AND sent_at > ?", (str(rpa_id), self._fresh_after())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading result cache: {e}")
+            return False
+        return row is not None and row[0] == content_digest(query_params)
+
+    def mark_sent(self, rpa_id, query_params):
+        if not self.enabled:
+            return
+        try:
+            self.db.execute(
+                "INSERT INTO rpa_updates (rpa_id, digest, sent_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(rpa_id) DO UPDATE SET digest = excluded.digest, sent_at = excluded.sent_at",
+                (str(rpa_id), content_digest(query_params), time.time()),
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Error writing result cache: {e}")
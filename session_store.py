@@ -0,0 +1,148 @@
+"""SQLite session store for Flask-Session.
+
+Sessions live in one SQLite table in WAL mode with an index on expiry, so
+readers never block the writer and expired rows are removed with a single
+range delete every ``evict_interval`` seconds. Each worker keeps the sessions
+it has recently read in a small in-memory cache, and a session is only
+written back when its serialized data changed or its stored expiry is more
+than ``refresh_interval`` seconds old. Every write sets a new expiry, so a
+cached copy is checked against the stored expiry before it is used; most
+requests therefore cost one primary-key read and no write.
+
+SQLite is shared by the workers of one host. Deployments spread over several
+hosts should use one of Flask-Session's network backends (``SESSION_TYPE=redis``).
+"""
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask_session.base import ServerSideSession, ServerSideSessionInterface
+from sqlite_db import SQLiteDatabase
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expiry REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)",
+)
+
+class SQLiteSession(ServerSideSession):
+    pass
+
+class SQLiteSessionInterface(ServerSideSessionInterface):
+    """Flask-Session interface backed by SQLite with a per-worker read cache."""
+
+    session_class = SQLiteSession
+    # Expiry is enforced by our own eviction; this also registers `flask session_cleanup`
+    ttl = False
+
+    def __init__(self, app, path, key_prefix="session:", use_signer=False, permanent=True,
+                 cache_ttl=10, cache_size=1024, refresh_interval=300, evict_interval=300):
+        self.db = SQLiteDatabase(path, SCHEMA)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self.evict_interval = evict_interval
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._last_eviction = 0.0
+        super().__init__(app, key_prefix, use_signer, permanent)
+
+    def _cached(self, store_id, now):
+        with self._cache_lock:
+            entry = self._cache.get(store_id)
+            if entry is None:
+                return None
+            if now - entry[2] > self.cache_ttl or entry[1] <= now:
+                del self._cache[store_id]
+                return None
+            self._cache.move_to_end(store_id)
+            return entry
+
+    def _remember(self, store_id, data, expiry, now):
+        if self.cache_ttl <= 0:
+            return
+        with self._cache_lock:
+            self._cache[store_id] = (data, expiry, now)
+            self._cache.move_to_end(store_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, store_id):
+        with self._cache_lock:
+            self._cache.pop(store_id, None)
+
+    def _validate_cached(self, store_id, entry):
+        # Another worker may have rewritten or deleted the session since we cached it
+        try:
+            row = self.db.execute("SELECT expiry FROM sessions WHERE id = ?", (store_id,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading session: {e}")
+            row = None
+        if row is None or row[0] != entry[1]:
+            self._forget(store_id)
+            return None
+        return entry
+
+    def _retrieve_session_data(self, store_id):
+        now = time.time()
+        entry = self._cached(store_id, now)
+        if entry is not None:
+            entry = self._validate_cached(store_id, entry)
+        if entry is None:
+            try:
+                row = self.db.execute(
+                    "SELECT data, expiry FROM sessions WHERE id = ? AND expiry > ?", (store_id, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logging.error(f"Error reading session: {e}")
+                return None
+            if row is None:
+                return None
+            entry = (bytes(row[0]), row[1], now)
+            self._remember(store_id, *entry)
+        return self.serializer.decode(entry[0])
+
+    def _delete_session(self, store_id):
+        self._forget(store_id)
+        try:
+            self.db.execute("DELETE FROM sessions WHERE id = ?", (store_id,))
+        except sqlite3.Error as e:
+            logging.error(f"Error deleting session: {e}")
+
+    def _upsert_session(self, session_lifetime, session, store_id):
+        now = time.time()
+        lifetime = session_lifetime.total_seconds()
+        data = self.serializer.encode(session)
+        entry = self._cached(store_id, now)
+        # Unchanged data whose stored expiry is still recent needs no write
+        if entry is not None and entry[0] == data and entry[1] - now > lifetime - self.refresh_interval:
+            return
+
+        expiry = now + lifetime
+        try:
+            self.db.execute(
+                "INSERT INTO sessions (id, data, expiry) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data, expiry = excluded.expiry",
+                (store_id, data, expiry),
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Error saving session: {e}")
+            self._forget(store_id)
+            return
+        self._remember(store_id, data, expiry, now)
+        self._maybe_evict(now)
+
+    def _maybe_evict(self, now):
+        if now - self._last_eviction < self.evict_interval:
+            return
+        self._last_eviction = now
+        self._delete_expired_sessions()
+
+    def _delete_expired_sessions(self):
+        try:
+            deleted = self.db.execute("DELETE FROM sessions WHERE expiry <= ?", (time.time(),)).rowcount
+        except sqlite3.Error as e:
+            logging.error(f"Error evicting expired sessions: {e}")
+            return
+        if deleted:
+            logging.info(f"Evicted {deleted} expired sessions")
@@ -0,0 +1,43 @@
+import logging
+import os
+import sqlite3
+import threading
+
+class SQLiteDatabase:
+    """Per-thread SQLite connections in WAL mode, reopened in forked workers.
+
+    ``schema`` statements run once on every new connection, so they must be
+    idempotent (``CREATE ... IF NOT EXISTS``).
+    """
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        self._schema = schema
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in self._schema:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    def ensure_column(self, table, column, definition):
+        """Add ``column`` to a table created before it existed."""
+        columns = [row[1] for row in self.execute(f"PRAGMA table_info({table})")]
+        if column in columns:
+            return
+        try:
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        except sqlite3.OperationalError as e:
+            # Another worker added it first
+            logging.info(f"{table}.{column}: {e}")
@@ -0,0 +1,231 @@
+"""Matplotlib-free growth charts.
+
+Each (chart, sex) reference table is laid out once into an SVG template with
+the curve paths, axes, grid and legend baked in. Rendering a chart is then a
+string substitution of the title, axis labels and the child's marker.
+"""
+import logging
+import math
+import threading
+from string import Template
+from xml.sax.saxutils import escape
+from charts import ALL_CHART_SPECS, CHART_SEXES, REFERENCE_CURVES, composite_regions, composite_rows, range_note
+
+WIDTH, HEIGHT = 600, 800
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 75, 60, 60, 70
+# matplotlib's default color cycle, so both backends look alike
+COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+          "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"]
+
+try:
+    import cairosvg
+except (ImportError, OSError):  # PNG output from the SVG backend is optional (needs libcairo)
+    cairosvg = None
+
+def _nice_ticks(low, high, target=7):
+    span = high - low
+    if span <= 0:
+        return [low]
+    raw = span / target
+    magnitude = 10 ** math.floor(math.log10(raw))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw)
+    first = math.ceil(low / step) * step
+    count = int(math.floor((high - first) / step + 1e-9)) + 1
+    return [round(first + i * step, 10) for i in range(count)]
+
+def _format_tick(value):
+    return f"{value:g}"
+
+def _padded(values, pad=0.05):
+    low, high = min(values), max(values)
+    if low == high:
+        low, high = low - 1, high + 1
+    margin = (high - low) * pad
+    return low - margin, high + margin
+
+def _curve_path(xs, ys, to_x, to_y):
+    commands = []
+    pen_down = False
+    for x, y in zip(xs, ys):
+        if math.isnan(x) or math.isnan(y):
+            pen_down = False
+            continue
+        commands.append(f"{'L' if pen_down else 'M'}{to_x(x):.1f},{to_y(y):.1f}")
+        pen_down = True
+    return "".join(commands)
+
+def build_svg_template(data, extra_points=(), ylim=None):
+    """Lay out one reference table; ``extra_points`` widen the axes to fit them."""
+    curves = [col for col in REFERENCE_CURVES if col in data]
+    xs = [float(x) for x in data.get("Age (years)", [])]
+    ys = [[float(y) for y in data[col]] for col in curves]
+    all_x = [x for x in xs if not math.isnan(x)]
+    all_y = list(ylim) if ylim else [y for column in ys for y in column if not math.isnan(y)]
+    for x, y in extra_points:
+        all_x.append(x)
+        all_y.append(y)
+    x_min, x_max = _padded(all_x or [0, 1])
+    y_min, y_max = _padded(all_y or [0, 1])
+
+    plot_w = WIDTH - MARGIN_LEFT - MARGIN_RIGHT
+    plot_h = HEIGHT - MARGIN_TOP - MARGIN_BOTTOM
+    x_scale = plot_w / (x_max - x_min)
+    y_scale = plot_h / (y_max - y_min)
+
+    def to_x(x):
+        return MARGIN_LEFT + (x - x_min) * x_scale
+
+    def to_y(y):
+        return MARGIN_TOP + plot_h - (y - y_min) * y_scale
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" '
+        f'viewBox="0 0 {WIDTH} {HEIGHT}" font-family="DejaVu Sans, Arial, sans-serif" font-size="12">',
+        f'<rect width="{WIDTH}" height="{HEIGHT}" fill="#fff"/>',
+        f'<rect x="{MARGIN_LEFT}" y="{MARGIN_TOP}" width="{plot_w}" height="{plot_h}" fill="none" stroke="#000"/>',
+    ]
+    for tick in _nice_ticks(x_min, x_max):
+        x = to_x(tick)
+        parts.append(f'<line x1="{x:.1f}" y1="{MARGIN_TOP}" x2="{x:.1f}" y2="{MARGIN_TOP + plot_h}" stroke="#b0b0b0" stroke-width="0.8"/>')
+        parts.append(f'<text x="{x:.1f}" y="{MARGIN_TOP + plot_h + 18}" text-anchor="middle">{_format_tick(tick)}</text>')
+    for tick in _nice_ticks(y_min, y_max, target=10):
+        y = to_y(tick)
+        parts.append(f'<line x1="{MARGIN_LEFT}" y1="{y:.1f}" x2="{MARGIN_LEFT + plot_w}" y2="{y:.1f}" stroke="#b0b0b0" stroke-width="0.8"/>')
+        parts.append(f'<text x="{MARGIN_LEFT - 6}" y="{y + 4:.1f}" text-anchor="end">{_format_tick(tick)}</text>')
+    for index, column in enumerate(ys):
+        path = _curve_path(xs, column, to_x, to_y)
+        parts.append(f'<path d="{path}" fill="none" stroke="{COLORS[index % len(COLORS)]}" stroke-width="1.5"/>')
+
+    legend_x, legend_y = MARGIN_LEFT + 10, MARGIN_TOP + 10
+    entries = curves + ["Child's History", "Child's Data"]
+    parts.append(f'<rect x="{legend_x}" y="{legend_y}" width="160" height="{len(entries) * 18 + 8}" '
+                 f'fill="#fff" fill-opacity="0.8" stroke="#ccc" rx="3"/>')
+    for index, label in enumerate(entries):
+        y = legend_y + 16 + index * 18
+        if label == "Child's Data":
+            parts.append(f'<circle cx="{legend_x + 18}" cy="{y - 4}" r="4" fill="red"/>')
+        elif label == "Child's History":
+            parts.append(f'<line x1="{legend_x + 6}" y1="{y - 4}" x2="{legend_x + 30}" y2="{y - 4}" stroke="#000"/>')
+            parts.append(f'<circle cx="{legend_x + 18}" cy="{y - 4}" r="2.5"/>')
+        else:
+            color = COLORS[index % len(COLORS)]
+            parts.append(f'<line x1="{legend_x + 6}" y1="{y - 4}" x2="{legend_x + 30}" y2="{y - 4}" stroke="{color}" stroke-width="1.5"/>')
+        parts.append(f'<text x="{legend_x + 38}" y="{y}">{escape(label)}</text>')
+
+    parts.append(f'<text x="{WIDTH / 2}" y="{MARGIN_TOP - 12}" text-anchor="middle" font-size="14">$title</text>')
+    parts.append(f'<text x="{MARGIN_LEFT + plot_w / 2}" y="{HEIGHT - 25}" text-anchor="middle">$xlabel</text>')
+    parts.append(f'<text transform="translate(22,{MARGIN_TOP + plot_h / 2}) rotate(-90)" text-anchor="middle">$ylabel</text>')
+    parts.append('$trajectory$point</svg>')
+
+    return {
+        "template": Template("".join(parts)),
+        "x_range": (x_min, x_max),
+        "y_range": (y_min, y_max),
+        "to_x": to_x,
+        "to_y": to_y,
+        "data": data,
+        "ylim": ylim,
+    }
+
+def build_svg_templates(reference_data):
+    templates = {}
+    for chart_key, spec in ALL_CHART_SPECS.items():
+        for sex in CHART_SEXES:
+            data = reference_data.get(f"{spec['table']}_{sex}_{spec['kind']}")
+            if data:
+                templates[(chart_key, sex)] = build_svg_template(data, ylim=spec.get("ylim"))
+    return templates
+
+_templates = None
+_templates_lock = threading.Lock()
+
+def get_svg_templates(reference_data):
+    global _templates
+    with _templates_lock:
+        if _templates is None:
+            _templates = build_svg_templates(reference_data)
+        return _templates
+
+def _in_range(template, age, metric):
+    (x0, x1), (y0, y1) = template["x_range"], template["y_range"]
+    return x0 <= age <= x1 and y0 <= metric <= y1
+
+def _note_svg(text):
+    # Boxed note at the centre of the plot area, in place of the child's point
+    lines = text.split("\n")
+    x = MARGIN_LEFT + (WIDTH - MARGIN_LEFT - MARGIN_RIGHT) / 2
+    y = MARGIN_TOP + (HEIGHT - MARGIN_TOP - MARGIN_BOTTOM) / 2
+    box_w, box_h = max(len(line) for line in lines) * 7 + 20, len(lines) * 16 + 12
+    parts = [f'<rect x="{x - box_w / 2:.1f}" y="{y - box_h / 2:.1f}" width="{box_w}" height="{box_h}" '
+             f'fill="#fff" stroke="#8b0000" rx="5"/>']
+    first_baseline = y - (len(lines) - 1) * 8 + 4
+    for index, line in enumerate(lines):
+        parts.append(f'<text x="{x:.1f}" y="{first_baseline + index * 16:.1f}" text-anchor="middle" '
+                     f'fill="#8b0000">{escape(line)}</text>')
+    return "".join(parts)
+
+def _trajectory_svg(template, points):
+    """SVG for the child's history line."""
+    to_x, to_y = template["to_x"], template["to_y"]
+    coords = [(to_x(x), to_y(y)) for x, y in points]
+    path = "".join(f"{'L' if index else 'M'}{x:.1f},{y:.1f}" for index, (x, y) in enumerate(coords))
+    markers = "".join(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="2.5"/>' for x, y in coords)
+    return f'<path d="{path}" fill="none" stroke="#000"/>{markers}'
+
+def render_svg_chart(templates, chart_key, sex, age, metric, output="svg", trajectory=None):
+    """Return the chart as SVG bytes, or PNG bytes when ``output="png"``.
+
+    ``trajectory`` is the child's ``(age, value)`` history. PNG needs the
+    optional ``cairosvg`` package; None is returned without it.
+    """
+    spec = ALL_CHART_SPECS[chart_key]
+    template = templates.get((chart_key, sex))
+    trajectory = tuple(tuple(point) for point in trajectory or ())
+    # No value means the age has no reference: the chart says so instead of plotting a point
+    points = trajectory + ((age, metric),) if metric is not None else trajectory
+    if template is None or not all(_in_range(template, *point) for point in points):
+        # Points off the precomputed axes get a one-off layout that includes them
+        template = build_svg_template(template["data"] if template else {}, extra_points=points,
+                                      ylim=spec.get("ylim"))
+    if metric is None:
+        point = _note_svg(range_note(template["data"], age))
+    else:
+        point = (f'<circle cx="{template["to_x"](age):.1f}" cy="{template["to_y"](metric):.1f}" '
+                 f'r="5" fill="red"/>')
+    svg = template["template"].substitute(
+        title=escape(spec["title"]),
+        xlabel="Age (years)",
+        ylabel=escape(spec["label"]),
+        trajectory=_trajectory_svg(template, trajectory) if trajectory else "",
+        point=point,
+    ).encode()
+    return _to_output(svg, output)
+
+def _to_output(svg, output):
+    if output == "png":
+        if cairosvg is None:
+            logging.error("cairosvg (with libcairo) is required for PNG output from the SVG backend")
+            return None
+        return cairosvg.svg2png(bytestring=svg)
+    return svg
+
+def render_svg_composite(templates, sex, points, output="svg"):
+    """Render every chart in ``points`` as a panel of one image.
+
+    ``points`` are ``(chart key, age, value, trajectory)`` as yielded by
+    ``charts.chart_points``; each panel is the chart's own SVG nested at its
+    cell. Returns ``(image bytes, manifest)`` with the same manifest as the
+    matplotlib composite.
+    """
+    rows = composite_rows([key for key, *_ in points])
+    regions = composite_regions(rows, WIDTH, HEIGHT)
+    width, height = WIDTH * max(len(keys) for keys in rows), HEIGHT * len(rows)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}">', f'<rect width="{width}" height="{height}" fill="#fff"/>']
+    for key, age, metric, trajectory in points:
+        panel = render_svg_chart(templates, key, sex, age, metric, "svg", trajectory).decode()
+        region = regions[key]
+        parts.append(panel.replace("<svg ", f'<svg x="{region["x"]}" y="{region["y"]}" ', 1))
+    parts.append("</svg>")
+    image = _to_output("".join(parts).encode(), output)
+    return image, {"width": width, "height": height, "panels": regions}
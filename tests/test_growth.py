@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from growth import LMS_TABLES, SEXES, build_reference_engine, compute_zscore, growth_metrics
+from reference import load_csv_tables
+
+# z-scores of the percentile columns the WHO tables publish
+PERCENTILE_Z = {"3rd Percentile": -1.880794, "50th Percentile": 0.0, "97th Percentile": 1.880794}
+# The tables print one decimal
+TABLE_ROUNDING = 0.05
+
+@pytest.fixture(scope="module")
+def tables():
+    return load_csv_tables()
+
+@pytest.fixture(scope="module")
+def engine(tables):
+    return build_reference_engine(tables)
+
+@pytest.mark.parametrize("indicator", LMS_TABLES)
+@pytest.mark.parametrize("sex", SEXES)
+@pytest.mark.parametrize("column", PERCENTILE_Z)
+def test_reproduces_published_percentiles(tables, engine, indicator, sex, column):
+    table = tables[f"{LMS_TABLES[indicator]}_{sex}_per"]
+    if column not in table:
+        pytest.skip(f"{indicator} table has no {column} column")
+    target = PERCENTILE_Z[column]
+    z, percentile = compute_zscore(engine, indicator, sex, table["Age (months)"], table[column])
+
+    # A rounded table value can be off by TABLE_ROUNDING, which moves z by about that over dvalue/dz;
+    # the slack covers the linearization and the rounded L, M and S
+    L, M, S = table["L"], table["M"], table["S"]
+    slope = M * S * np.power(1 + L * S * target, 1 / L - 1)
+    assert np.all(np.abs(z - target) <= 1.1 * TABLE_ROUNDING / slope)
+    expected = {-1.880794: 3.0, 0.0: 50.0, 1.880794: 97.0}[target]
+    assert np.all(np.abs(percentile - expected) < 1.5)
+
+def test_scalar_matches_array(engine):
+    ages = np.array([61.0, 100.5, 150.25, 228.0])
+    heights = np.array([110.0, 131.2, 152.0, 176.5])
+    z, percentile = compute_zscore(engine, "height", "girls", ages, heights)
+    for index, (age, height) in enumerate(zip(ages, heights)):
+        scalar_z, scalar_percentile = compute_zscore(engine, "height", "girls", age, height)
+        assert isinstance(scalar_z, float)
+        assert scalar_z == pytest.approx(z[index])
+        assert scalar_percentile == pytest.approx(percentile[index])
+
+def test_ages_outside_the_table_have_no_score(engine):
+    z, percentile = compute_zscore(engine, "weight", "boys", np.array([60.0, 121.0]), np.array([20.0, 30.0]))
+    assert np.isnan(z).all() and np.isnan(percentile).all()
+    metrics = growth_metrics(engine, "boys", 130, height=140.0, weight=32.0, bmi=16.3)
+    assert metrics["weight_z"] is None and metrics["weight_percentile"] is None
+    assert metrics["height_z"] is not None and metrics["bmi_z"] is not None
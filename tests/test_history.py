@@ -0,0 +1,53 @@
+import sqlite3
+from datetime import date
+import pytest
+from history import MeasurementStore, trajectories
+
+@pytest.fixture
+def store(tmp_path):
+    return MeasurementStore(str(tmp_path / "history.db"))
+
+def test_velocity_uses_measurement_dates(store):
+    # Reported ages 8 and 9 approximate to 8.5 and 9.5 years, but the visits are two months apart
+    store.add_visit("c", "d1", "A", "boys", 8.5, date(2024, 9, 1), {"height": 130.0})
+    store.add_visit("c", "d2", "A", "boys", 9.5, date(2024, 11, 1), {"height": 131.0})
+    (age, velocity), = trajectories(store.visits("c"))["height_velocity"]
+    assert age == pytest.approx(9.0)
+    assert velocity == pytest.approx(1.0 / (61 / 365.25))
+
+def test_visits_within_one_reported_year_get_a_velocity(store):
+    store.add_visit("c", "d1", "A", "girls", 7.5, date(2024, 1, 10), {"weight": 22.0})
+    store.add_visit("c", "d2", "A", "girls", 7.5, date(2024, 7, 10), {"weight": 23.5})
+    (_, velocity), = trajectories(store.visits("c"))["weight_velocity"]
+    assert velocity == pytest.approx(1.5 / (182 / 365.25))
+
+def test_visits_too_close_together_get_no_velocity(store):
+    store.add_visit("c", "d1", "A", "girls", 7.5, date(2024, 1, 10), {"weight": 22.0})
+    store.add_visit("c", "d2", "A", "girls", 7.5, date(2024, 2, 10), {"weight": 22.4})
+    assert trajectories(store.visits("c"))["weight_velocity"] == []
+
+def test_visits_are_ordered_by_measurement_date(store):
+    store.add_visit("c", "d2", "A", "boys", 9.5, date(2024, 11, 1), {"height": 131.0})
+    store.add_visit("c", "d1", "A", "boys", 8.5, date(2024, 9, 1), {"height": 130.0})
+    assert [visit["measured_on"] for visit in store.visits("c")] == [date(2024, 9, 1), date(2024, 11, 1)]
+
+def test_old_store_gains_measured_on(tmp_path):
+    path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE visits (id INTEGER PRIMARY KEY, child TEXT NOT NULL, digest TEXT NOT NULL, name TEXT, "
+        "sex TEXT, age_years REAL NOT NULL, height REAL, weight REAL, bmi REAL, recorded_at REAL NOT NULL, "
+        "UNIQUE (child, digest))"
+    )
+    # 2024-03-01 00:00 UTC
+    connection.execute("INSERT INTO visits (child, digest, age_years, height, recorded_at) "
+                       "VALUES ('c', 'd0', 8.5, 128.0, 1709251200)")
+    connection.commit()
+    connection.close()
+
+    store = MeasurementStore(path)
+    store.add_visit("c", "d1", "A", "boys", 8.5, date(2024, 9, 1), {"height": 131.0})
+    visits = store.visits("c")
+    assert [visit["measured_on"] for visit in visits] == [date(2024, 3, 1), date(2024, 9, 1)]
+    (_, velocity), = trajectories(visits)["height_velocity"]
+    assert velocity == pytest.approx(3.0 / (184 / 365.25))
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+import pytest
+from jobs import JobQueue, QueueFull, _process_token
+
+def wait_for(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["finished_at"] is not None:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()
+
+def test_job_result_is_stored(path):
+    queue = JobQueue(path, workers=2, max_pending=10, result_ttl=60)
+    job, created = queue.submit("a", lambda x: {"double": x * 2}, 21)
+    assert created and job["status"] == "queued"
+    job = wait_for(queue, job["id"])
+    assert job["status"] == "succeeded" and job["result"] == {"double": 42}
+
+def test_failure_is_recorded(path):
+    queue = JobQueue(path, workers=1, max_pending=10, result_ttl=60)
+
+    def fail():
+        raise ValueError("boom")
+
+    job = wait_for(queue, queue.submit("a", fail)[0]["id"])
+    assert job["status"] == "failed" and job["error"] == "boom"
+
+def test_unfinished_key_is_deduplicated_across_queues(path, release):
+    # Two queues on one database stand in for two gunicorn workers
+    first, second = (JobQueue(path, workers=1, max_pending=10, result_ttl=60) for _ in range(2))
+    job, created = first.submit(["rpa", "link"], release.wait)
+    duplicate, duplicate_created = second.submit(["rpa", "link"], release.wait)
+    assert created and not duplicate_created
+    assert duplicate["id"] == job["id"]
+    assert second.get(job["id"])["id"] == job["id"]
+
+    release.set()
+    wait_for(first, job["id"])
+    # A finished job no longer holds its key
+    assert second.submit(["rpa", "link"], lambda: None)[1]
+
+def test_queue_full(path, release):
+    queue = JobQueue(path, workers=1, max_pending=1, result_ttl=60)
+    queue.submit("a", release.wait)
+    with pytest.raises(QueueFull):
+        queue.submit("b", release.wait)
+    assert queue.pending() == 1
+
+def test_finished_jobs_are_purged_after_ttl(path):
+    queue = JobQueue(path, workers=1, max_pending=10, result_ttl=60)
+    job = wait_for(queue, queue.submit("a", lambda: None)[0]["id"])
+    queue.db.execute("UPDATE jobs SET finished_at = ? WHERE id = ?", (time.time() - 120, job["id"]))
+    queue.submit("b", lambda: None)
+    assert queue.get(job["id"]) is None
+
+def insert_unfinished(queue, job_id, key, owner, token):
+    queue.db.execute(
+        "INSERT INTO jobs (id, dedupe_key, status, owner, owner_token, submitted_at) VALUES (?, ?, 'running', ?, ?, ?)",
+        (job_id, f'"{key}"', owner, token, time.time()),
+    )
+
+@pytest.mark.skipif(_process_token(os.getpid()) is None, reason="needs /proc")
+def test_job_of_a_previous_process_with_a_reused_pid_is_failed(path):
+    queue = JobQueue(path, workers=1, max_pending=10, result_ttl=60)
+    # Same PID as this process, but a different start time
+    insert_unfinished(queue, "stale", "a", os.getpid(), "old-boot:1")
+    job, created = queue.submit("a", lambda: None)
+    assert created and job["id"] != "stale"
+    stale = queue.get("stale")
+    assert stale["status"] == "failed" and "exited" in stale["error"]
+
+def test_job_of_a_live_owner_is_kept(path):
+    queue = JobQueue(path, workers=1, max_pending=10, result_ttl=60)
+    insert_unfinished(queue, "live", "a", os.getpid(), _process_token(os.getpid()))
+    job, created = queue.submit("a", lambda: None)
+    assert not created and job["id"] == "live"
@@ -0,0 +1,44 @@
+from datetime import date
+import pytest
+import app
+
+@pytest.mark.parametrize("text", ["2024.11.03 09:41", "2024-11-03", "03.11.2024", "03/11/2024"])
+def test_parse_report_date_formats(text):
+    assert app.parse_report_date(text) == date(2024, 11, 3)
+
+@pytest.mark.parametrize("text", [None, "", "   ", "yesterday", "2024/13/45"])
+def test_parse_report_date_rejects_other_text(text):
+    assert app.parse_report_date(text) is None
+
+def test_age_without_birth_date_is_mid_year():
+    assert app.report_age_months({"age": "5"}) == 66
+    assert app.report_age_months({"age": "9", "measured_at": "2024.11.03 09:41"}) == 114
+
+def test_age_from_birth_date_is_exact():
+    report = {"age": "8", "birth_date": "2016.05.03", "measured_at": "2024.11.03 09:41"}
+    assert app.report_age_months(report) == pytest.approx((date(2024, 11, 3) - date(2016, 5, 3)).days / (365.25 / 12))
+
+def test_birth_date_after_measurement_falls_back_to_mid_year(caplog):
+    report = {"age": "8", "birth_date": "2025.01.01", "measured_at": "2024.11.03"}
+    assert app.report_age_months(report) == 102
+    assert "after the measurement" in caplog.text
+
+def test_disagreeing_birth_date_is_kept_and_logged(caplog):
+    report = {"age": "5", "birth_date": "2016.05.03", "measured_at": "2024.11.03"}
+    assert app.report_age_months(report) // 12 == 8
+    assert "disagrees" in caplog.text
+
+def test_chart_series_leaves_out_ages_past_the_reference():
+    # Weight-for-age stops at 120 months; height-for-age runs to 228
+    series = {
+        "weight": [(9.5, 30.0), (10.5, 33.0)],
+        "height": [(9.5, 135.0), (10.5, 140.0)],
+        "weight_velocity": [(9.0, 2.5), (10.25, 3.0)],
+        "height_velocity": [(10.0, 5.0)],
+    }
+    clipped = app.chart_series(series, "girls")
+    assert clipped["weight"] == [(9.5, 30.0)]
+    assert clipped["height"] == series["height"]
+    assert clipped["height_velocity"] == series["height_velocity"]
+    # The latest weight velocity is past the table, so no velocity chart highlights an older one
+    assert "weight_velocity" not in clipped
@@ -0,0 +1,71 @@
+import datetime
+import pytest
+from flask import Flask
+import session_store
+from session_store import SQLiteSessionInterface
+
+LIFETIME = datetime.timedelta(hours=1)
+
+def make_interface(path, **options):
+    app = Flask(__name__)
+    app.secret_key = "test"
+    return SQLiteSessionInterface(app, path, **options)
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+def stored_expiry(interface, store_id):
+    return interface.db.execute("SELECT expiry FROM sessions WHERE id = ?", (store_id,)).fetchone()[0]
+
+def test_cached_session_rewritten_by_another_worker_is_reread(path):
+    first, second = make_interface(path), make_interface(path)
+    first._upsert_session(LIFETIME, {"v": 1}, "sid")
+    assert second._retrieve_session_data("sid") == {"v": 1}
+    first._upsert_session(LIFETIME, {"v": 2}, "sid")
+    # second still caches v1, but its expiry no longer matches the row
+    assert second._retrieve_session_data("sid") == {"v": 2}
+
+def test_cached_session_deleted_by_another_worker_is_gone(path):
+    first, second = make_interface(path), make_interface(path)
+    first._upsert_session(LIFETIME, {"v": 1}, "sid")
+    assert second._retrieve_session_data("sid") == {"v": 1}
+    first._delete_session("sid")
+    assert second._retrieve_session_data("sid") is None
+
+def test_unchanged_session_is_not_written(path, monkeypatch):
+    interface = make_interface(path, refresh_interval=300)
+    clock = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: clock[0])
+    interface._upsert_session(LIFETIME, {"v": 1}, "sid")
+    written = stored_expiry(interface, "sid")
+
+    # A later request reads the session, leaves it unchanged and saves it
+    clock[0] += 60
+    assert interface._retrieve_session_data("sid") == {"v": 1}
+    interface._upsert_session(LIFETIME, {"v": 1}, "sid")
+    assert stored_expiry(interface, "sid") == written
+
+    interface._upsert_session(LIFETIME, {"v": 2}, "sid")
+    assert stored_expiry(interface, "sid") == clock[0] + LIFETIME.total_seconds()
+
+def test_unchanged_session_is_refreshed_after_refresh_interval(path, monkeypatch):
+    interface = make_interface(path, refresh_interval=300)
+    clock = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: clock[0])
+    interface._upsert_session(LIFETIME, {"v": 1}, "sid")
+    clock[0] += 301
+    assert interface._retrieve_session_data("sid") == {"v": 1}
+    interface._upsert_session(LIFETIME, {"v": 1}, "sid")
+    assert stored_expiry(interface, "sid") == clock[0] + LIFETIME.total_seconds()
+
+def test_expired_sessions_are_not_returned_and_are_evicted(path, monkeypatch):
+    interface = make_interface(path, evict_interval=0)
+    clock = [1000.0]
+    monkeypatch.setattr(session_store.time, "time", lambda: clock[0])
+    interface._upsert_session(datetime.timedelta(seconds=10), {"v": 1}, "old")
+    clock[0] += 11
+    assert interface._retrieve_session_data("old") is None
+    interface._upsert_session(LIFETIME, {"v": 2}, "new")
+    ids = [row[0] for row in interface.db.execute("SELECT id FROM sessions")]
+    assert ids == ["new"]
@@ -0,0 +1,75 @@
+import threading
+import time
+from tokens import SingleFlight, TokenCache
+
+def test_concurrent_callers_share_one_refresh():
+    flight = SingleFlight(result_ttl=60)
+    calls = []
+    started = threading.Event()
+
+    def refresh():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return {"access_token": "new"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("refresh-1", refresh))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"access_token": "new"}] * 8
+
+def test_late_caller_gets_the_kept_result():
+    flight = SingleFlight(result_ttl=60)
+    assert flight.do("refresh-1", lambda: "first") == "first"
+    # The refresh token has rotated; replaying it would be rejected
+    assert flight.do("refresh-1", lambda: "second") == "first"
+    assert flight.do("refresh-2", lambda: "second") == "second"
+
+def test_failed_refresh_is_not_kept():
+    flight = SingleFlight(result_ttl=60)
+    assert flight.do("refresh-1", lambda: None) is None
+    assert flight.do("refresh-1", lambda: "retried") == "retried"
+
+def test_leader_exception_releases_followers():
+    flight = SingleFlight(result_ttl=60)
+    started, results = threading.Event(), []
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("oauth down")
+
+    def lead():
+        try:
+            flight.do("refresh-1", fail)
+        except RuntimeError:
+            results.append("raised")
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(flight.do("refresh-1", lambda: "unused")))
+    follower.start()
+    leader.join()
+    follower.join(timeout=2)
+    assert not follower.is_alive()
+    assert sorted(results, key=str) == [None, "raised"]
+
+def test_token_cache_expiry_and_invalidation():
+    cache = TokenCache(default_ttl=60)
+    assert not cache.is_valid("a")
+    cache.mark_valid("a")
+    assert cache.is_valid("a")
+    cache.invalidate("a")
+    assert not cache.is_valid("a")
+    # A token expiring sooner than the default is trusted only until then
+    cache.mark_valid("b", ttl=0.05)
+    time.sleep(0.06)
+    assert not cache.is_valid("b")
+    cache.mark_valid("c", ttl=-1)
+    assert not cache.is_valid("c")
+    assert not cache.is_valid("")
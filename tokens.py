@@ -0,0 +1,85 @@
+import hashlib
+import threading
+import time
+
+def _token_key(token):
+    # Keep raw tokens out of long-lived process memory
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenCache:
+    """Remembers which access tokens were recently confirmed valid."""
+
+    def __init__(self, default_ttl):
+        self._default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._valid_until = {}
+
+    def is_valid(self, token):
+        if not token:
+            return False
+        key = _token_key(token)
+        with self._lock:
+            valid_until = self._valid_until.get(key)
+            if valid_until is None:
+                return False
+            if valid_until <= time.time():
+                del self._valid_until[key]
+                return False
+            return True
+
+    def mark_valid(self, token, ttl=None):
+        ttl = self._default_ttl if ttl is None else min(ttl, self._default_ttl)
+        if not token or ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._valid_until = {key: until for key, until in self._valid_until.items() if until > now}
+            self._valid_until[_token_key(token)] = now + ttl
+
+    def invalidate(self, token):
+        if token:
+            with self._lock:
+                self._valid_until.pop(_token_key(token), None)
+
+class SingleFlight:
+    """Collapses concurrent calls sharing a key into one execution.
+
+    Successful results are kept for ``result_ttl`` seconds, so callers that
+    arrive just after a refresh (still holding the rotated refresh token) get
+    the new tokens instead of replaying a refresh that Bitrix would reject.
+    Falsy results are not kept.
+    """
+
+    def __init__(self, result_ttl):
+        self._result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        key = _token_key(key)
+        with self._lock:
+            now = time.time()
+            self._calls = {k: call for k, call in self._calls.items()
+                           if call["expires_at"] is None or call["expires_at"] > now}
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "result": None, "expires_at": None}
+                self._calls[key] = call
+
+        if not leader:
+            call["event"].wait()
+            return call["result"]
+
+        result = None
+        try:
+            result = func()
+        finally:
+            with self._lock:
+                call["result"] = result
+                if result:
+                    call["expires_at"] = time.time() + self._result_ttl
+                else:
+                    self._calls.pop(key, None)
+            call["event"].set()
+        return result